@@ -1,14 +1,21 @@
 # Default
+import time
+import hashlib
+import asyncio
+import importlib.util
 from typing import Literal
 
 # FastAPI
 from fastapi import HTTPException
 
 # Requirements
-import requests
+import httpx
 
 # .env
 from app.script.settings import settings
+from app.script.cache import TTLCache
+from app.script.metrics import NAVIDROME_SECONDS
+from app.script.state import get_state
 
 # ------------------------
 # Navidrome API
@@ -23,85 +30,241 @@ API_PARAMS = {
     "f": "json",
 }
 
-def navidrome_request(scope: Literal["getArtists", "getAlbumList2", "getGenres", "search3"], params: dict) -> dict:
-    r = requests.get(
-        f"{settings.NAVIDROME_URL}/rest/{scope}",
-        params=params,
-        timeout=5
-    )
+# Cache risposte Navidrome: TTL (secondi) per scope
+CACHE_TTL = {
+    "getArtists": settings.NAVIDROME_CACHE_TTL,
+    "getAlbumList2": settings.NAVIDROME_CACHE_TTL,
+    "getArtist": settings.NAVIDROME_CACHE_TTL,
+    "getGenres": settings.NAVIDROME_CACHE_TTL * 4,
+    "search3": 60,
+}
+
+navidrome_cache = TTLCache(
+    max_entries=settings.NAVIDROME_CACHE_SIZE,
+    stale_ttl=settings.NAVIDROME_CACHE_STALE,
+)
+
+# ------------------------
+# Client HTTP condiviso
+# ------------------------
+_client = None
+_limit = None
+_refresh_tasks = set()
+_invalidated_seen = 0.0
+_invalidation_checked = 0.0
+INVALIDATION_CHECK_INTERVAL = 1.0  # secondi tra due letture del segnale di invalidazione
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Client asincrono con pool di connessioni keep-alive (HTTP/2 se h2 è installato)
+    """
+    global _client, _limit
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=f"{settings.NAVIDROME_URL}/rest",
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(settings.NAVIDROME_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.NAVIDROME_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.NAVIDROME_MAX_CONNECTIONS,
+            ),
+        )
+        _limit = asyncio.Semaphore(settings.NAVIDROME_CONCURRENCY)
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _get(path: str, params: dict) -> httpx.Response:
+    client = get_client()
+    async with _limit:
+        start = time.perf_counter()
+        r = await client.get(path, params=params)
+        NAVIDROME_SECONDS.labels(path.lstrip("/")).observe(time.perf_counter() - start)
     r.raise_for_status()
+    return r
+
+async def _fetch_navidrome(scope: str, params: dict, store: bool = True) -> dict:
+    r = await _get(f"/{scope}", params)
     data = r.json()
     
     if "subsonic-response" in data and data["subsonic-response"].get("status") == "failed":
-        return HTTPException(status_code=404, detail=f"Navidrome error: {data['subsonic-response']['error']['message']}")
-    
+        raise HTTPException(status_code=404, detail=f"Navidrome error: {data['subsonic-response']['error']['message']}")
+
+    if store:
+        key = (scope, tuple(sorted(params.items())))
+        ttl = CACHE_TTL.get(scope, 60)
+        navidrome_cache.set(key, data, ttl)
+        # Scrittura sullo stato condiviso fuori dal loop (la risposta può essere grande)
+        await asyncio.to_thread(get_state().set, _shared_key(key), data, ttl=ttl)
     return data
 
-### TENDINE
-def get_navidrome_artist():
-    params = API_PARAMS.copy()
-    params['type'] = "alphabeticalByName"
-    params['size'] = "500"
-    data = navidrome_request(scope="getArtists", params=params)
-    
-    
-    index = [artist for artist in data['subsonic-response']['artists']['index']]
-    artist_objs = [artista['artist'] for artista in index]
-    
-    artist_list = []
-    
-    for array in artist_objs:
-        for element in array:
-            obj = {}
-            obj['id'] = element['id']
-            obj['name'] = element['name']
-            artist_list.append(obj)
-        
-    return artist_list
+def _shared_key(key) -> str:
+    # I parametri contengono le credenziali: nello stato condiviso solo il loro hash
+    return f"navidrome:{key[0]}:{hashlib.sha1(repr(key[1]).encode()).hexdigest()}"
+
+async def _shared_lookup(key):
+    """
+    Risposta già scaricata da un altro worker, copiata nella cache locale
+    """
+    entry = await asyncio.to_thread(get_state().get_entry, _shared_key(key))
+    if entry is None:
+        return None
+    data, expires = entry
+    navidrome_cache.set(key, data, max(expires - time.time(), 1))
+    return data
+
+async def _refresh_navidrome(scope: str, params: dict, key):
+    try:
+        await _fetch_navidrome(scope, params)
+    except Exception as e:
+        print(f"Errore aggiornando la cache {scope}: {e}")
+    finally:
+        navidrome_cache.end_refresh(key)
 
+async def navidrome_request(scope: Literal["getArtists", "getIndexes", "getAlbumList2", "getAlbum", "getGenres", "search3", "getArtist", "startScan", "getScanStatus"], params: dict, cache: bool = True) -> dict:
+    if not cache:
+        return await _fetch_navidrome(scope, params, store=False)
 
-def get_navidrome_albums():
+    await _sync_invalidation()
+
+    key = (scope, tuple(sorted(params.items())))
+    found, data, stale = navidrome_cache.lookup(key)
+
+    if not found:
+        data = await _shared_lookup(key)
+        if data is not None:
+            return data
+        return await _fetch_navidrome(scope, params)
+
+    # Stale-while-revalidate: risposta immediata, aggiornamento in background
+    if stale and navidrome_cache.begin_refresh(key):
+        task = asyncio.create_task(_refresh_navidrome(scope, params, key))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+
+    return data
+
+def _artist_key(artist_id: str):
     params = API_PARAMS.copy()
-    params['type'] = "alphabeticalByName"
-    params['size'] = "500"
-    data = navidrome_request(scope="getAlbumList2", params=params)
-    albums = [album['name'] for album in data['subsonic-response']['albumList2']['album']]
-    return albums
+    params["id"] = artist_id
+    return ("getArtist", tuple(sorted(params.items())))
+
+def _invalidate_local(scopes: list | None, artist_ids: list | None = None):
+    if scopes is None:
+        navidrome_cache.invalidate()
+    else:
+        navidrome_cache.invalidate(lambda key: key[0] in scopes)
+    if artist_ids:
+        keys = {_artist_key(artist_id) for artist_id in artist_ids}
+        navidrome_cache.invalidate(lambda key: key in keys)
+
+async def invalidate_navidrome_cache(scopes: list | None = None, artist_ids: list | None = None):
+    """
+    Svuota la cache (tutta o solo gli scope indicati), es. dopo un upload;
+    con artist_ids anche le risposte getArtist di quegli artisti.
+    Gli altri worker vengono avvisati tramite lo stato condiviso.
+    """
+    _invalidate_local(scopes, artist_ids)
+    await asyncio.to_thread(_invalidate_shared, scopes, artist_ids)
+
+def _invalidate_shared(scopes: list | None, artist_ids: list | None):
+    if scopes is None:
+        get_state().delete_prefix("navidrome:")
+    else:
+        for scope in scopes:
+            get_state().delete_prefix(f"navidrome:{scope}:")
+    for artist_id in artist_ids or []:
+        get_state().delete(_shared_key(_artist_key(artist_id)))
+    global _invalidated_seen
+    _invalidated_seen = time.time()
+    get_state().set("navidrome-invalidated", {"at": _invalidated_seen, "scopes": scopes, "artist_ids": artist_ids})
+
+async def _sync_invalidation():
+    """
+    Applica alla cache locale le invalidazioni fatte da altri worker,
+    controllando il segnale al massimo una volta ogni INVALIDATION_CHECK_INTERVAL
+    """
+    global _invalidated_seen, _invalidation_checked
+    now = time.monotonic()
+    if now - _invalidation_checked < INVALIDATION_CHECK_INTERVAL:
+        return
+    _invalidation_checked = now
+    event = await asyncio.to_thread(get_state().get, "navidrome-invalidated")
+    if event is None or event["at"] <= _invalidated_seen:
+        return
+    _invalidated_seen = event["at"]
+    _invalidate_local(event["scopes"], event.get("artist_ids"))
+
+### SCANSIONE LIBRERIA
+async def _scan_request(scope: str) -> dict:
+    data = await navidrome_request(scope=scope, params=API_PARAMS.copy(), cache=False)
+    return data["subsonic-response"].get("scanStatus", {})
 
-def get_navidrome_genres():
+
+async def rescan_navidrome(timeout: float) -> dict:
+    """
+    Avvia una scansione (startScan, incrementale) e attende che finisca
+    interrogando getScanStatus con intervalli crescenti.
+    Ritorna l'ultimo scanStatus; TimeoutError oltre timeout secondi.
+    """
+    status = await _scan_request("startScan")
+    last_scan = status.get("lastScan")
+    seen_scanning = status.get("scanning", False)
+
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
+        # La scansione parte in modo asincrono: finita solo dopo averla vista
+        # in corso, oppure se nel frattempo è cambiata la data dell'ultima
+        await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        status = await _scan_request("getScanStatus")
+        if status.get("scanning"):
+            seen_scanning = True
+        elif seen_scanning or status.get("lastScan") != last_scan:
+            return status
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Scansione Navidrome non completata in {timeout:.0f} s")
+        delay = min(delay * 2, 5)
+
+
+### TENDINE
+async def get_navidrome_genres():
     params = API_PARAMS.copy()
-    data = navidrome_request(scope="getGenres", params=params)
+    data = await navidrome_request(scope="getGenres", params=params)
     genres = [genre['value'] for genre in data['subsonic-response']['genres']['genre']]
     return genres
 
 
 ### DUPLICATI
-def check_duplicates_navidrome(artist: str):
-    
+async def search_artist_songs(artist: str) -> list:
+    """
+    Brani trovati da search3 per il nome dell'artista, come (artista, titolo).
+    Usato finché l'indice dei brani del catalogo non è pronto.
+    """
     params = API_PARAMS.copy()
     params.update({
         "c": "dup-check",
         "query": artist,
+        "artistCount": "0",
+        "albumCount": "0",
+        "songCount": "500",
     })
-    
-    data = navidrome_request(scope="search3", params=params)
-    search_result = data.get("subsonic-response", {}).get("searchResult3", {})
-    
-    tracks = []
+    data = await navidrome_request(scope="search3", params=params)
+    songs = data["subsonic-response"].get("searchResult3", {}).get("song", [])
+    return [(s.get("artist"), s.get("title")) for s in songs]
 
-    for s in search_result.get("song", []):
-        if s.get("artist", "").lower() == artist.lower():
-            tracks.append(s.get("title"))
-
-    return tracks
 
 ### INFORMAZIONI ALBUM
-def get_albums_by_artist(artist_id: str):
+async def get_albums_by_artist(artist_id: str):
     params = API_PARAMS.copy()
     params.update({
         "id": artist_id
     })
-    data = navidrome_request(scope="getArtist", params=params)
+    data = await navidrome_request(scope="getArtist", params=params)
 
     albums = data["subsonic-response"]["artist"]["album"]
 
@@ -116,10 +279,10 @@ def get_albums_by_artist(artist_id: str):
         for a in albums
     ]
 
-def get_navidrome_image(cover_id: str, size: int = 250) -> bytes:
+async def get_navidrome_image(cover_id: str, size: int = 250) -> tuple[bytes, str] | None:
     try:
-        r = requests.get(
-            f"{settings.NAVIDROME_URL}/rest/getCoverArt",
+        r = await _get(
+            "/getCoverArt",
             params={
                 "u": settings.NAVIDROME_USER,
                 "p": settings.NAVIDROME_PASS,
@@ -128,9 +291,12 @@ def get_navidrome_image(cover_id: str, size: int = 250) -> bytes:
                 "id": cover_id,
                 "size": size
             },
-            timeout=5
         )
-        r.raise_for_status()
-        return r
     except Exception:
-        return b""
\ No newline at end of file
+        return None
+
+    # In caso di errore Navidrome risponde con un JSON invece dell'immagine
+    mime = r.headers.get("Content-Type", "image/jpeg")
+    if not mime.startswith("image/"):
+        return None
+    return r.content, mime
@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+
+# ------------------------
+# Cache TTL + LRU
+# ------------------------
+class TTLCache:
+    """
+    Cache in memoria con scadenza per voce ed eviction LRU.
+    Una voce scaduta resta utilizzabile come "stale" per stale_ttl secondi:
+    chi la legge la riceve subito e si occupa di aggiornarla in background.
+    """
+
+    def __init__(self, max_entries: int, stale_ttl: int):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (valore, scadenza)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """
+        Ritorna (trovato, valore, stale)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or now > entry[1] + self.stale_ttl:
+                self._data.pop(key, None)
+                self.misses += 1
+                return False, None, False
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[0], now > entry[1]
+
+    def set(self, key, value, ttl: int):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def begin_refresh(self, key) -> bool:
+        """
+        True se il chiamante deve aggiornare la voce (nessun altro lo sta già facendo)
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, match=None):
+        """
+        Rimuove le voci per cui match(key) è vero, oppure tutta la cache
+        """
+        with self._lock:
+            if match is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,451 @@
+# Default
+import os
+import json
+import time
+import asyncio
+from pathlib import Path
+
+# .env
+from app.script.settings import settings
+from app.script.apis import API_PARAMS, navidrome_request, search_artist_songs
+from app.script.duplicates import DuplicateIndex, normalize_key
+from app.script.suggest import SuggestIndex
+from app.script.state import get_state
+
+# ------------------------
+# Catalogo Navidrome locale
+# ------------------------
+# Indice di artisti e album sincronizzato con Navidrome: il primo accesso
+# scarica l'intero catalogo pagina per pagina, i successivi aggiornano solo
+# le novità (getIndexes con ifModifiedSince per gli artisti, getAlbumList2
+# "newest" per gli album) senza riscaricare tutto.
+# Artisti e album sono pronti appena scaricati; l'indice dei duplicati
+# (tutti i brani, via search3) viene costruito in background e fino ad
+# allora i controlli dei duplicati interrogano search3 per l'artista.
+# Il catalogo viene salvato in CATALOG_FILE e ricaricato all'avvio.
+# Da artisti e album vengono costruiti gli indici per l'autocompletamento.
+# Con più worker un solo processo alla volta sincronizza (lock nello stato
+# condiviso) e salva CATALOG_FILE; gli altri lo ricaricano quando cambia
+# "catalog:version".
+PAGE_SIZE = 500
+SYNC_LOCK = "catalog:sync-lock"
+SONGS_LOCK = "catalog:songs-lock"
+SYNC_LOCK_TTL = 600       # secondi, rilasciato prima se il worker termina la sync
+SONGS_LOCK_TTL = 3600     # la scansione di tutti i brani può essere lunga
+SYNC_LOCK_WAIT = 30       # attesa massima del lock per gli aggiornamenti mirati
+SYNC_POLL_INTERVAL = 0.5
+SONGS_RETRY_INTERVAL = 60
+SHARED_CHECK_INTERVAL = 1.0
+
+
+class Catalog:
+
+    def __init__(self):
+        self.artists = []   # [{id, name, cover}]
+        self.albums = {}    # id -> {id, name, artist, artist_id, year, genre, cover}
+        self.duplicates = DuplicateIndex()
+        self.songs_ready = False
+        self.suggest = {}   # "artist" | "album" | "genre" -> SuggestIndex
+        self.artists_modified = 0
+        self.last_sync = 0
+        self.last_full_sync = 0
+        self.stale = False
+        self.version = 0    # versione di CATALOG_FILE rappresentata in memoria
+        self._checked = 0.0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._songs_task = None
+        self._songs_attempt = 0.0
+
+    # Chiamate Navidrome senza cache: ogni sync deve vedere lo stato attuale
+    async def _request(self, scope: str, **extra) -> dict:
+        params = API_PARAMS.copy()
+        params.update(extra)
+        data = await navidrome_request(scope=scope, params=params, cache=False)
+        return data["subsonic-response"]
+
+    async def _fetch_artists(self) -> list:
+        data = await self._request("getArtists")
+        return [
+            {"id": a["id"], "name": a["name"], "cover": a.get("coverArt")}
+            for index in data["artists"].get("index", [])
+            for a in index.get("artist", [])
+        ]
+
+    async def _fetch_album_page(self, list_type: str, offset: int) -> list:
+        data = await self._request("getAlbumList2", type=list_type, size=str(PAGE_SIZE), offset=str(offset))
+        return data["albumList2"].get("album", [])
+
+    async def _fetch_songs(self, index: DuplicateIndex):
+        # search3 con query vuota restituisce tutti i brani, a pagine
+        offset = 0
+        while True:
+            data = await self._request("search3", query="", songCount=str(PAGE_SIZE), songOffset=str(offset), artistCount="0", albumCount="0")
+            songs = data["searchResult3"].get("song", [])
+            for song in songs:
+                index.add(song.get("artist"), song.get("title"))
+            if len(songs) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+    async def _fetch_album_songs(self, album_id: str, index: DuplicateIndex):
+        data = await self._request("getAlbum", id=album_id)
+        for song in data["album"].get("song", []):
+            index.add(song.get("artist"), song.get("title"))
+
+    @staticmethod
+    def _album(a: dict) -> dict:
+        return {
+            "id": a["id"],
+            "name": a["name"],
+            "artist": a.get("artist"),
+            "artist_id": a.get("artistId"),
+            "year": a.get("year"),
+            "genre": a.get("genre"),
+            "cover": a.get("coverArt"),
+        }
+
+    # Sincronizzazione completa
+    async def full_sync(self):
+        artists = await self._fetch_artists()
+        indexes = await self._request("getIndexes")
+
+        albums = {}
+        offset = 0
+        while True:
+            page = await self._fetch_album_page("alphabeticalByName", offset)
+            for a in page:
+                albums[a["id"]] = self._album(a)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        self.artists = artists
+        self.albums = albums
+        self.artists_modified = indexes["indexes"].get("lastModified", 0)
+        self.last_sync = self.last_full_sync = time.time()
+        self.stale = False
+        self._build_suggest()
+        await self._save()
+        self._start_songs_sync(force=True)
+
+    # Indice dei brani in background
+    async def _sync_songs(self):
+        # Un solo worker scansiona i brani, gli altri ricaricano il suo file
+        if not await self._acquire(SONGS_LOCK, ttl=SONGS_LOCK_TTL):
+            return
+        try:
+            duplicates = DuplicateIndex()
+            await self._fetch_songs(duplicates)
+            if not await self._acquire(SYNC_LOCK, wait=SYNC_LOCK_WAIT):
+                raise RuntimeError("catalogo occupato da un altro worker")
+            try:
+                async with self._lock:
+                    # Brani aggiunti nel frattempo, anche da altri worker
+                    await self._reload(force=True)
+                    for artist, title in self.duplicates.entries():
+                        duplicates.add(artist, title)
+                    self.duplicates = duplicates
+                    self.songs_ready = True
+                    await self._save()
+            finally:
+                await self._release(SYNC_LOCK)
+        except Exception as e:
+            print(f"Errore durante la sincronizzazione dei brani: {e}")
+        finally:
+            await self._release(SONGS_LOCK)
+
+    def _start_songs_sync(self, force: bool = False):
+        if self._songs_task is not None and not self._songs_task.done():
+            return
+        # Senza force (indice mancante) al massimo un tentativo ogni SONGS_RETRY_INTERVAL
+        if force or (not self.songs_ready and time.time() - self._songs_attempt > SONGS_RETRY_INTERVAL):
+            self._songs_attempt = time.time()
+            self._songs_task = asyncio.create_task(self._sync_songs())
+
+    # Sincronizzazione incrementale
+    async def incremental_sync(self):
+        # Artisti: ricaricati solo se l'indice è cambiato
+        indexes = await self._request("getIndexes", ifModifiedSince=str(self.artists_modified))
+        modified = indexes["indexes"].get("lastModified", 0)
+        if modified > self.artists_modified:
+            self.artists = await self._fetch_artists()
+            self.artists_modified = modified
+
+        # Album: pagine "newest" finché non compare un album già noto
+        offset = 0
+        while True:
+            page = await self._fetch_album_page("newest", offset)
+            known = False
+            for a in page:
+                if a["id"] in self.albums:
+                    known = True
+                    break
+                self.albums[a["id"]] = self._album(a)
+                await self._fetch_album_songs(a["id"], self.duplicates)
+            if known or len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+        self.last_sync = time.time()
+        self.stale = False
+        self._build_suggest()
+        await self._save()
+
+    # Aggiornamento mirato dopo un upload
+    async def refresh_artist(self, name: str) -> str | None:
+        """
+        Ricarica da Navidrome album e brani di un solo artista (dopo la
+        scansione che segue un upload). Ritorna l'id dell'artista, oppure
+        None se Navidrome non lo conosce ancora, se il catalogo non è
+        ancora stato caricato (ci penserà la prima sincronizzazione) o se
+        un altro worker lo sta già aggiornando.
+        """
+        if not self.last_sync:
+            return None
+
+        if not await self._acquire(SYNC_LOCK, wait=SYNC_LOCK_WAIT):
+            return None
+        try:
+            async with self._lock:
+                # Parte dall'ultima versione salvata da qualsiasi worker
+                await self._reload(force=True)
+                data = await self._request("search3", query=name, artistCount="10", albumCount="0", songCount="0")
+                wanted = normalize_key(name)
+                match = next(
+                    (a for a in data["searchResult3"].get("artist", []) if normalize_key(a["name"]) == wanted),
+                    None,
+                )
+                if match is None:
+                    return None
+
+                artist = await self._request("getArtist", id=match["id"])
+                for a in artist["artist"].get("album", []):
+                    self.albums[a["id"]] = self._album(a)
+                    await self._fetch_album_songs(a["id"], self.duplicates)
+
+                if not any(a["id"] == match["id"] for a in self.artists):
+                    self.artists.append({"id": match["id"], "name": match["name"], "cover": match.get("coverArt")})
+                    self.artists.sort(key=lambda a: a["name"].casefold())
+
+                self._build_suggest()
+                await self._save()
+        finally:
+            await self._release(SYNC_LOCK)
+
+        return match["id"]
+
+    async def sync(self):
+        async with self._lock:
+            now = time.time()
+            if not self.last_full_sync or now - self.last_full_sync > settings.CATALOG_FULL_SYNC_INTERVAL:
+                await self.full_sync()
+            elif self.stale or now - self.last_sync > settings.CATALOG_SYNC_INTERVAL:
+                await self.incremental_sync()
+
+    async def _leader_sync(self) -> bool:
+        """
+        Sincronizzazione eseguita da un solo worker alla volta; gli altri
+        ricaricano il risultato da CATALOG_FILE. False se il lock è di un altro worker.
+        """
+        if not await self._acquire(SYNC_LOCK):
+            return False
+        try:
+            await self.sync()
+        finally:
+            await self._release(SYNC_LOCK)
+        return True
+
+    async def _background_sync(self):
+        try:
+            await self._leader_sync()
+        except Exception as e:
+            print(f"Errore durante la sincronizzazione del catalogo: {e}")
+
+    async def _first_sync(self):
+        # Il primo worker scarica il catalogo, gli altri aspettano il suo file
+        while not await self._leader_sync():
+            await asyncio.sleep(SYNC_POLL_INTERVAL)
+            await self._reload()
+            if self.last_sync:
+                return
+
+    async def ensure(self):
+        """
+        Catalogo pronto all'uso: il primo caricamento è bloccante, gli
+        aggiornamenti successivi avvengono in background.
+        """
+        if not self.last_sync:
+            await self._reload(force=True)
+        if not self.last_sync:
+            await self._first_sync()
+            return
+
+        # Stato condiviso letto al massimo una volta ogni SHARED_CHECK_INTERVAL
+        now = time.monotonic()
+        if now - self._checked >= SHARED_CHECK_INTERVAL:
+            self._checked = now
+            await self._reload()
+            # Upload completato da un altro worker dopo l'ultima sincronizzazione
+            if await asyncio.to_thread(get_state().get, "catalog:stale", 0) > self.last_sync:
+                self.stale = True
+            # Catalogo caricato da disco senza brani, o build precedente fallita
+            self._start_songs_sync()
+
+            due = self.stale or time.time() - self.last_sync > settings.CATALOG_SYNC_INTERVAL
+            if due and (self._task is None or self._task.done()):
+                self._task = asyncio.create_task(self._background_sync())
+
+    async def stop(self):
+        # Sincronizzazioni in background annullate prima di chiudere il client HTTP
+        for task in (self._task, self._songs_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    async def mark_stale(self):
+        self.stale = True
+        await asyncio.to_thread(get_state().set, "catalog:stale", time.time())
+
+    # Coordinamento tra worker: lock con scadenza nello stato condiviso
+    @staticmethod
+    def _shared() -> bool:
+        # Senza CATALOG_FILE ogni worker tiene il proprio catalogo
+        return bool(settings.CATALOG_FILE)
+
+    async def _acquire(self, key: str, wait: float = 0, ttl: float = SYNC_LOCK_TTL) -> bool:
+        if not self._shared():
+            return True
+        deadline = time.monotonic() + wait
+        while True:
+            if await asyncio.to_thread(get_state().incr, key, ttl) == 1:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(SYNC_POLL_INTERVAL)
+
+    async def _release(self, key: str):
+        if self._shared():
+            await asyncio.to_thread(get_state().delete, key)
+
+    # Persistenza su disco (CATALOG_FILE, "" per disattivarla)
+    async def _save(self):
+        if not self._shared():
+            return
+        # Serializzato nel loop, scritto e annunciato agli altri worker in un thread
+        self.version = time.time()
+        payload = json.dumps({
+            "version": self.version,
+            "artists": self.artists,
+            "albums": list(self.albums.values()),
+            "songs": self.duplicates.entries() if self.songs_ready else None,
+            "artists_modified": self.artists_modified,
+            "last_sync": self.last_sync,
+            "last_full_sync": self.last_full_sync,
+        })
+        await asyncio.to_thread(self._write, payload, self.version)
+
+    @staticmethod
+    def _write(payload: str, version: float):
+        path = Path(settings.CATALOG_FILE)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(payload)
+        tmp.replace(path)
+        get_state().set("catalog:version", version)
+
+    @staticmethod
+    def _read(known: float) -> dict | None:
+        # Solo se un worker ha salvato una versione più recente di quella in memoria
+        version = get_state().get("catalog:version", 0)
+        if known and version <= known:
+            return None
+        path = Path(settings.CATALOG_FILE)
+        if not path.is_file():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except Exception as e:
+            print(f"Catalogo locale non leggibile: {e}")
+            return None
+
+    async def _reload(self, force: bool = False):
+        if not self._shared():
+            return
+        data = await asyncio.to_thread(self._read, 0 if force else self.version)
+        if data is None or data.get("version", 0) <= self.version:
+            return
+        self.version = data.get("version", 0)
+        self.artists = data["artists"]
+        self.albums = {a["id"]: a for a in data["albums"]}
+        duplicates = DuplicateIndex()
+        for artist, title in data.get("songs") or []:
+            duplicates.add(artist, title)
+        # Brani del worker non ancora nel file (build in corso) restano validi
+        if not data.get("songs"):
+            for artist, title in self.duplicates.entries():
+                duplicates.add(artist, title)
+        self.duplicates = duplicates
+        self.songs_ready = self.songs_ready or data.get("songs") is not None
+        self.artists_modified = data["artists_modified"]
+        self.last_full_sync = data["last_full_sync"]
+        self.last_sync = data.get("last_sync", self.last_full_sync)
+        self.stale = False
+        self._build_suggest()
+
+    # Autocompletamento
+    def _build_suggest(self):
+        genres = {}
+        for a in self.albums.values():
+            if a.get("genre"):
+                genres.setdefault(a["genre"].casefold(), a["genre"])
+        self.suggest = {
+            "artist": SuggestIndex([{"id": a["id"], "name": a["name"], "cover": a.get("cover")} for a in self.artists]),
+            "album": SuggestIndex([
+                {"id": a["id"], "name": a["name"], "artist": a.get("artist"), "cover": a.get("cover")}
+                for a in self.albums.values()
+            ]),
+            "genre": SuggestIndex([{"id": None, "name": name} for name in sorted(genres.values(), key=str.casefold)]),
+        }
+
+
+catalog = Catalog()
+
+### TENDINE
+async def get_navidrome_artist():
+    await catalog.ensure()
+    return [{"id": a["id"], "name": a["name"]} for a in catalog.artists]
+
+
+async def get_navidrome_albums():
+    await catalog.ensure()
+    return sorted((a["name"] for a in catalog.albums.values()), key=str.casefold)
+
+
+### AUTOCOMPLETAMENTO
+async def suggest(kind: str, query: str, limit: int = 10) -> list:
+    await catalog.ensure()
+    index = catalog.suggest.get(kind)
+    return index.search(query, limit) if index else []
+
+
+### DUPLICATI
+async def _duplicates_for(artist: str) -> DuplicateIndex:
+    await catalog.ensure()
+    if catalog.songs_ready:
+        return catalog.duplicates
+    # Indice dei brani non ancora pronto: solo i brani dell'artista via search3
+    index = DuplicateIndex()
+    for song_artist, title in await search_artist_songs(artist):
+        index.add(song_artist, title)
+    return index
+
+
+async def check_duplicates_navidrome(artist: str):
+    return (await _duplicates_for(artist)).titles(artist)
+
+
+async def check_duplicates_batch(artist: str, titles: list):
+    return (await _duplicates_for(artist)).check(artist, titles)
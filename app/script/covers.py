@@ -0,0 +1,310 @@
+import io
+import os
+import asyncio
+import hashlib
+import time
+import threading
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+
+from app.script.settings import settings
+from app.script.metrics import COVER_REQUESTS
+from app.script.state import get_state
+
+# ------------------------
+# Cache copertine su disco
+# ------------------------
+# Le immagini sono salvate per contenuto (sha256) in blobs/, con il MIME type
+# accanto; keys/ associa ogni variante (cover_id, size) al relativo hash.
+# Quando la cartella supera max_bytes vengono eliminate le immagini usate
+# meno di recente (mtime aggiornato ad ogni lettura).
+# Le copertine estratte dai file caricati stanno in uploads/, fuori
+# dall'eviction: vengono eliminate upload_ttl secondi dopo l'ultimo utilizzo,
+# ma mai mentre un job le usa (claim nello stato condiviso, come i file
+# temporanei).
+UPLOAD_CLAIM_TTL = 86400
+
+
+class CoverCache:
+
+    def __init__(self, directory: str, max_bytes: int, upload_ttl: int):
+        self.dir = Path(directory).resolve()
+        self.max_bytes = max_bytes
+        self.upload_ttl = upload_ttl
+        self.total = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._uploads_swept = 0.0
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.dir / "blobs" / digest
+
+    def _key_path(self, cover_id: str, size: int) -> Path:
+        key = hashlib.sha1(f"{cover_id}:{size}".encode()).hexdigest()
+        return self.dir / "keys" / key
+
+    # Lettura
+    def blob(self, digest: str):
+        """
+        (path, mime, etag) di un'immagine già salvata, oppure None
+        """
+        path = self._blob_path(digest)
+        mime_path = path.with_suffix(".mime")
+        try:
+            mime = mime_path.read_text()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path, mime, f'"{digest}"'
+
+    def lookup(self, cover_id: str, size: int):
+        key_path = self._key_path(cover_id, size)
+        try:
+            digest = key_path.read_text()
+        except FileNotFoundError:
+            return None
+
+        found = self.blob(digest)
+        if found is None:
+            # Immagine rimossa dall'eviction
+            key_path.unlink(missing_ok=True)
+        return found
+
+    # Scrittura
+    def put(self, content: bytes, mime: str) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+
+        with self._lock:
+            if not path.is_file():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(content)
+                path.with_suffix(".mime").write_text(mime)
+                tmp.replace(path)
+                self._account(len(content))
+            else:
+                os.utime(path)
+
+        return digest
+
+    def store(self, cover_id: str, size: int, content: bytes, mime: str):
+        digest = self.put(content, mime)
+        key_path = self._key_path(cover_id, size)
+        key_path.parent.mkdir(parents=True, exist_ok=True)
+        key_path.write_text(digest)
+        return self._blob_path(digest), mime, f'"{digest}"'
+
+    # Copertine degli upload
+    def _upload_path(self, digest: str) -> Path:
+        return self.dir / "uploads" / digest
+
+    def put_upload(self, content: bytes, mime: str) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._upload_path(digest)
+
+        with self._lock:
+            if not path.is_file():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_bytes(content)
+                path.with_suffix(".mime").write_text(mime)
+                tmp.replace(path)
+            else:
+                os.utime(path)
+
+        # Pulizia al massimo una volta ogni upload_ttl, alla scrittura
+        now = time.time()
+        if now - self._uploads_swept > self.upload_ttl:
+            self._uploads_swept = now
+            self._sweep_uploads(now)
+        return digest
+
+    def upload(self, digest: str):
+        """
+        (path, mime, etag) di una copertina estratta da un upload, oppure None
+        """
+        path = self._upload_path(digest)
+        try:
+            mime = path.with_suffix(".mime").read_text()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path, mime, f'"{digest}"'
+
+    def claim_upload(self, digest: str):
+        # Contatore: più job possono usare la stessa copertina
+        get_state().incr(f"cover-claim:{digest}", UPLOAD_CLAIM_TTL)
+
+    def release_upload(self, digest: str):
+        # La scadenza riparte dalla fine del job
+        get_state().incr(f"cover-claim:{digest}", UPLOAD_CLAIM_TTL, -1)
+        try:
+            os.utime(self._upload_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _sweep_uploads(self, now: float):
+        expired = []
+        for p in (self.dir / "uploads").iterdir():
+            try:
+                if not p.suffix and p.stat().st_mtime + self.upload_ttl < now:
+                    expired.append(p)
+            except FileNotFoundError:
+                pass
+        if not expired:
+            return
+        claims = get_state().get_many([f"cover-claim:{p.name}" for p in expired])
+        for p in expired:
+            if claims.get(f"cover-claim:{p.name}", 0) > 0:
+                continue
+            p.unlink(missing_ok=True)
+            p.with_suffix(".mime").unlink(missing_ok=True)
+
+    # Eviction LRU
+    def _account(self, added: int):
+        if self.total is None:
+            blobs = self.dir / "blobs"
+            self.total = sum(p.stat().st_size for p in blobs.iterdir() if not p.suffix)
+        else:
+            self.total += added
+
+        if self.total <= self.max_bytes:
+            return
+
+        blobs = sorted(
+            (p for p in (self.dir / "blobs").iterdir() if not p.suffix),
+            key=lambda p: p.stat().st_mtime,
+        )
+        # Libera fino al 90% del limite per non rieseguire l'eviction ad ogni scrittura
+        for p in blobs:
+            if self.total <= self.max_bytes * 0.9:
+                break
+            self.total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            p.with_suffix(".mime").unlink(missing_ok=True)
+
+    # Lettura con fetch coalescente
+    async def get(self, cover_id: str, size: int, fetch):
+        """
+        Ritorna (path, mime, etag) dalla cache, scaricando con fetch() al primo
+        accesso. Richieste concorrenti per la stessa variante attendono un'unica
+        fetch verso Navidrome.
+        """
+        found = await run_in_threadpool(self.lookup, cover_id, size)
+        if found:
+            COVER_REQUESTS.labels("hit").inc()
+            return found
+
+        key = (cover_id, size)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            COVER_REQUESTS.labels("coalesced").inc()
+            return await asyncio.shield(pending)
+
+        COVER_REQUESTS.labels("fetch").inc()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+            if result is not None:
+                content, mime = result
+                result = await run_in_threadpool(self.store, cover_id, size, content, mime)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+            # Evita il warning "exception never retrieved" se nessuno era in attesa
+            if future.done() and not future.cancelled():
+                future.exception()
+
+
+def cover_response(request: Request, path: Path, mime: str, etag: str):
+    """
+    Risposta con ETag forte e Cache-Control; 304 se il client ha già l'immagine
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.COVER_MAX_AGE}",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=mime, headers=headers)
+
+
+# ------------------------
+# Copertine da incorporare nei tag
+# ------------------------
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def detect_image_mime(data: bytes) -> str | None:
+    """
+    MIME type reale dell'immagine dai magic bytes, oppure None
+    """
+    for signature, mime in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def normalize_cover(data: bytes) -> tuple[str, bytes]:
+    """
+    Copertina pronta per l'APIC come (mime, dati).
+    Se supera COVER_EMBED_MAX_PX di lato o COVER_EMBED_MAX_KB viene
+    ridimensionata e ricompressa in JPEG; senza Pillow resta invariata.
+    """
+    mime = detect_image_mime(data)
+    if mime is None:
+        raise ValueError("Formato copertina non supportato")
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return mime, data
+
+    max_px = settings.COVER_EMBED_MAX_PX
+    max_bytes = settings.COVER_EMBED_MAX_KB * 1024
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if max(image.size) <= max_px and len(data) <= max_bytes and mime in ("image/jpeg", "image/png"):
+            return mime, data
+
+        image = image.convert("RGB")
+        image.thumbnail((max_px, max_px), Image.LANCZOS)
+    except Exception as e:
+        raise ValueError(f"Copertina non leggibile: {e}")
+
+    # Qualità decrescente finché non rientra nel limite
+    for quality in (90, 80, 70, 60):
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True)
+        if out.tell() <= max_bytes:
+            break
+    return "image/jpeg", out.getvalue()
+
+
+cover_cache = CoverCache(
+    directory=settings.COVER_CACHE_DIR,
+    max_bytes=settings.COVER_CACHE_MAX_MB * 1024 * 1024,
+    upload_ttl=settings.TEMP_TTL,
+)
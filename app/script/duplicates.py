@@ -0,0 +1,59 @@
+import re
+import unicodedata
+
+# ------------------------
+# Normalizzazione chiavi
+# ------------------------
+# Parti tra parentesi con feat./remaster/remix ecc. e suffissi " - Remastered 2011"
+_BRACKETS = re.compile(r"[\(\[][^\)\]]*\b(feat|ft|featuring|with|remaster(ed)?|mono|stereo|version|edit)\b[^\)\]]*[\)\]]", re.I)
+_DASH_SUFFIX = re.compile(r"\s[-–]\s.*\b(remaster(ed)?|version|edit|mono|stereo)\b.*$", re.I)
+_FEAT = re.compile(r"\s(feat\.?|ft\.?|featuring)\s.*$", re.I)
+_NON_ALNUM = re.compile(r"[^\w]+")
+
+
+def normalize_key(text: str) -> str:
+    """
+    Chiave di confronto: senza feat./remaster, senza accenti, casefold
+    """
+    if not text:
+        return ""
+    text = _BRACKETS.sub(" ", text)
+    text = _DASH_SUFFIX.sub("", text)
+    text = _FEAT.sub("", text)
+    text = text.replace("'", "").replace("’", "")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _NON_ALNUM.sub(" ", text.casefold())
+    return " ".join(text.split())
+
+# ------------------------
+# Indice duplicati
+# ------------------------
+class DuplicateIndex:
+    """
+    Artista normalizzato -> {titolo normalizzato: (artista, titolo) originali}
+    """
+
+    def __init__(self):
+        self._index = {}
+
+    def add(self, artist: str, title: str):
+        if not artist or not title:
+            return
+        self._index.setdefault(normalize_key(artist), {})[normalize_key(title)] = (artist, title)
+
+    def titles(self, artist: str) -> list:
+        return [title for _, title in self._index.get(normalize_key(artist), {}).values()]
+
+    def check(self, artist: str, titles: list) -> list:
+        """
+        Per ogni titolo: True se l'artista ha già un brano equivalente
+        """
+        known = self._index.get(normalize_key(artist), {})
+        return [normalize_key(t) in known for t in titles]
+
+    def entries(self) -> list:
+        return [entry for songs in self._index.values() for entry in songs.values()]
+
+    def __len__(self):
+        return sum(len(songs) for songs in self._index.values())
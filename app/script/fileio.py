@@ -0,0 +1,62 @@
+import io
+import os
+
+# ------------------------
+# Copie file senza passare da Python
+# ------------------------
+# copy_file_range (stesso filesystem, eventualmente reflink) e sendfile
+# spostano i byte nel kernel; il ciclo read/write resta solo come ripiego
+# per sistemi o file che non li supportano.
+FALLBACK_CHUNK = 1024 * 1024
+
+
+def real_fileno(f) -> int | None:
+    """
+    Descrittore del file su disco, oppure None se il contenuto è solo in memoria
+    (SpooledTemporaryFile non ancora scritto su disco, BytesIO...)
+    """
+    if getattr(f, "_rolled", True) is False:
+        return None
+    try:
+        return f.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int):
+    """
+    Copia count byte di src_fd a partire da offset nella posizione corrente di dst_fd
+    """
+    remaining = count
+    for method in ("copy_file_range", "sendfile"):
+        func = getattr(os, method, None)
+        if func is None:
+            continue
+        try:
+            while remaining > 0:
+                if method == "copy_file_range":
+                    sent = func(src_fd, dst_fd, remaining, offset)
+                else:
+                    sent = func(dst_fd, src_fd, offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+            if remaining == 0:
+                return
+        except OSError:
+            # Non supportato per questa coppia di file: prova il metodo successivo
+            continue
+
+    while remaining > 0:
+        chunk = os.pread(src_fd, min(FALLBACK_CHUNK, remaining), offset)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        offset += len(chunk)
+        remaining -= len(chunk)
+
+    if remaining:
+        raise IOError(f"Copia incompleta: mancano {remaining} byte")
@@ -0,0 +1,101 @@
+import time
+import mmap
+import sqlite3
+import hashlib
+import threading
+
+from app.script import id3
+from app.script.settings import settings
+
+# ------------------------
+# Impronta dei dati audio
+# ------------------------
+# sha256 dei soli frame audio, senza tag ID3v2/ID3v1: la riscrittura dei
+# tag in upload-final non cambia l'impronta, quindi lo stesso file
+# ricaricato (anche con tag diversi) viene riconosciuto.
+def audio_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        start, end = id3.audio_bounds(f)
+        if end > start:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, memoryview(data) as view:
+                with view[start:end] as audio:
+                    digest.update(audio)
+    return digest.hexdigest()
+
+# ------------------------
+# Indice tracce caricate
+# ------------------------
+# Impronta -> percorso remoto dell'ultimo upload SFTP riuscito, in un
+# file SQLite persistente (FINGERPRINT_FILE) condiviso tra i worker.
+# Nello stesso file: sha256 dell'intero file remoto per percorso, valido
+# finché dimensione e mtime remoti non cambiano (vedi ssh_utils).
+class FingerprintIndex:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS tracks ("
+                    "digest TEXT PRIMARY KEY, remote_path TEXT NOT NULL, artist TEXT, "
+                    "album TEXT, title TEXT, size INTEGER, uploaded REAL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS remote_files ("
+                    "remote_path TEXT PRIMARY KEY, sha256 BLOB NOT NULL, size INTEGER, mtime INTEGER)"
+                )
+                self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, digests: list) -> dict:
+        """
+        Impronta -> {remote_path, artist, album, title, uploaded} per quelle già caricate
+        """
+        digests = [d for d in set(digests) if d]
+        if not digests:
+            return {}
+        placeholders = ",".join("?" * len(digests))
+        rows = self._conn().execute(
+            f"SELECT digest, remote_path, artist, album, title, uploaded FROM tracks WHERE digest IN ({placeholders})",
+            digests,
+        ).fetchall()
+        return {
+            row[0]: {"remote_path": row[1], "artist": row[2], "album": row[3], "title": row[4], "uploaded": row[5]}
+            for row in rows
+        }
+
+    def record(self, digest: str, remote_path: str, artist: str, album: str, title: str, size: int):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tracks (digest, remote_path, artist, album, title, size, uploaded) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (digest, remote_path, artist, album, title, size, time.time()),
+        )
+
+    def remote_digest(self, remote_path: str, size: int, mtime: int) -> bytes | None:
+        row = self._conn().execute(
+            "SELECT sha256 FROM remote_files WHERE remote_path = ? AND size = ? AND mtime = ?",
+            (remote_path, size, mtime),
+        ).fetchone()
+        return row[0] if row else None
+
+    def record_remote(self, remote_path: str, digest: bytes, size: int, mtime: int):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO remote_files (remote_path, sha256, size, mtime) VALUES (?, ?, ?, ?)",
+            (remote_path, digest, size, mtime),
+        )
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+
+fingerprints = FingerprintIndex(settings.FINGERPRINT_FILE)
@@ -0,0 +1,497 @@
+import os
+import mmap
+import zlib
+import struct
+
+from app.script.settings import settings
+from app.script.fileio import copy_range
+
+# ------------------------
+# Motore ID3v2 minimale
+# ------------------------
+# Legge e scrive solo la regione del tag ID3v2 in testa al file, senza
+# scansionare i frame audio. La durata viene calcolata dall'header
+# Xing/Info (con ritardo/padding LAME) o VBRI del primo frame MPEG, e solo
+# in mancanza stimata dal bitrate come per i file CBR.
+# Supporta ID3v2.3 e v2.4; per tutto il resto solleva ID3Error e
+# metadata.py ripiega su mutagen.
+
+class ID3Error(Exception):
+    pass
+
+
+HEADER_SIZE = 10
+PROBE_SIZE = 64 * 1024
+
+# Frame presenti solo in v2.3: rinominati o scartati quando si scrive in v2.4
+# (TYER/TDAT/TIME confluiscono in TDRC, vedi v23_recording_time)
+V23_RENAMED = {"TORY": "TDOR", "IPLS": "TIPL"}
+V23_DROPPED = {"TYER", "TDAT", "TIME", "TRDA", "TSIZ", "EQUA", "RVAD"}
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _to_syncsafe(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def _unsync(data: bytes) -> bytes:
+    return data.replace(b"\xff\x00", b"\xff")
+
+
+class Tag:
+    """
+    Frame del tag come lista di (id, dati) già decodificati da unsync/compressione.
+    Per gli APIC non richiesti i dati sono None.
+    size è lo spazio occupato su disco (header, frame, padding ed eventuale footer).
+    """
+
+    def __init__(self, version: int = 4, size: int = 0):
+        self.version = version
+        self.size = size
+        self.frames = []
+
+    def get(self, frame_id: str) -> list:
+        return [data for fid, data in self.frames if fid == frame_id]
+
+    def text(self, frame_id: str) -> str:
+        for data in self.get(frame_id):
+            values = decode_text(data)
+            if values:
+                return values[0]
+        return ""
+
+    def picture(self):
+        """
+        Prima copertina come (mime, dati), oppure None
+        """
+        for data in self.get("APIC"):
+            if data is not None:
+                try:
+                    return decode_apic(data)
+                except ID3Error:
+                    continue
+        return None
+
+# ------------------------
+# Lettura
+# ------------------------
+def read_header(f) -> tuple[int, int, int]:
+    """
+    (versione, flag, dimensione totale del tag) oppure (0, 0, 0) se il file non ha tag
+    """
+    f.seek(0)
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:3] != b"ID3":
+        return 0, 0, 0
+
+    version, flags = header[3], header[5]
+    if version not in (3, 4):
+        raise ID3Error(f"ID3v2.{version} non supportato")
+    if any(b & 0x80 for b in header[6:10]):
+        raise ID3Error("Dimensione tag non valida")
+
+    size = HEADER_SIZE + _syncsafe(header[6:10])
+    if version == 4 and flags & 0x10:
+        size += HEADER_SIZE  # footer
+    return version, flags, size
+
+
+def read_tag(f, include_pictures: bool = True) -> Tag:
+    try:
+        return _read_tag(f, include_pictures)
+    except struct.error:
+        raise ID3Error("Extended header troncato")
+
+
+def _read_tag(f, include_pictures: bool) -> Tag:
+    version, flags, size = read_header(f)
+    if not version:
+        return Tag()
+
+    tag = Tag(version, size)
+    body_size = size - HEADER_SIZE - (HEADER_SIZE if version == 4 and flags & 0x10 else 0)
+
+    if flags & 0x80 and version == 3:
+        # Unsync a livello di tag: serve il corpo intero
+        body = _unsync(f.read(body_size))
+        if flags & 0x40:
+            body = body[4 + struct.unpack(">I", body[:4])[0]:]
+        _parse_frames(tag, memoryview(body), include_pictures)
+        return tag
+
+    # Salta l'extended header
+    start = HEADER_SIZE
+    if flags & 0x40:
+        raw = f.read(4)
+        start += (4 + struct.unpack(">I", raw)[0]) if version == 3 else _syncsafe(raw)
+
+    _read_frames(tag, f, start, HEADER_SIZE + body_size, include_pictures)
+    return tag
+
+
+def audio_bounds(f) -> tuple[int, int]:
+    """
+    (inizio, fine) dei dati audio: esclude il tag ID3v2 in testa (di qualsiasi
+    versione) e un eventuale ID3v1 in coda
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(0)
+    header = f.read(HEADER_SIZE)
+
+    start = 0
+    if len(header) == HEADER_SIZE and header[:3] == b"ID3" and not any(b & 0x80 for b in header[6:10]):
+        start = HEADER_SIZE + _syncsafe(header[6:10])
+        if header[3] == 4 and header[5] & 0x10:
+            start += HEADER_SIZE  # footer
+    start = min(start, file_size)
+
+    end = file_size
+    if end - start >= 128:
+        f.seek(-128, os.SEEK_END)
+        if f.read(3) == b"TAG":
+            end -= 128
+    return start, end
+
+
+def _frame_size(raw: bytes, version: int) -> int:
+    # Alcuni encoder scrivono in v2.4 dimensioni non syncsafe
+    if version == 4 and not any(b & 0x80 for b in raw):
+        return _syncsafe(raw)
+    return struct.unpack(">I", raw)[0]
+
+
+def _valid_id(frame_id: bytes) -> bool:
+    return all(48 <= c <= 57 or 65 <= c <= 90 for c in frame_id)
+
+
+def _read_frames(tag: Tag, f, offset: int, end: int, include_pictures: bool):
+    """
+    Legge i frame uno alla volta: gli APIC non richiesti vengono saltati con seek
+    """
+    f.seek(offset)
+    while offset + HEADER_SIZE <= end:
+        header = f.read(HEADER_SIZE)
+        frame_id = header[:4]
+        if len(header) < HEADER_SIZE or frame_id[0] == 0 or not _valid_id(frame_id):
+            break  # padding
+
+        size = _frame_size(header[4:8], tag.version)
+        offset += HEADER_SIZE + size
+        if offset > end:
+            raise ID3Error("Frame oltre la fine del tag")
+
+        fid = frame_id.decode("ascii")
+        if fid == "APIC" and not include_pictures:
+            f.seek(size, os.SEEK_CUR)
+            tag.frames.append((fid, None))
+            continue
+
+        data = _frame_data(f.read(size), header[8:10], tag.version)
+        if data is not None:
+            tag.frames.append((fid, data))
+
+
+def _parse_frames(tag: Tag, body: memoryview, include_pictures: bool):
+    offset = 0
+    while offset + HEADER_SIZE <= len(body):
+        header = bytes(body[offset:offset + HEADER_SIZE])
+        frame_id = header[:4]
+        if frame_id[0] == 0 or not _valid_id(frame_id):
+            break
+
+        size = _frame_size(header[4:8], tag.version)
+        raw = bytes(body[offset + HEADER_SIZE:offset + HEADER_SIZE + size])
+        offset += HEADER_SIZE + size
+
+        fid = frame_id.decode("ascii")
+        if fid == "APIC" and not include_pictures:
+            tag.frames.append((fid, None))
+            continue
+
+        data = _frame_data(raw, header[8:10], tag.version)
+        if data is not None:
+            tag.frames.append((fid, data))
+
+
+def _frame_data(data: bytes, flags: bytes, version: int) -> bytes | None:
+    """
+    Dati del frame senza unsync/compressione; None se cifrato o non leggibile
+    """
+    fmt = flags[1]
+    try:
+        if version == 4:
+            if fmt & 0x04 or fmt & 0x40:  # cifrato / group id
+                return None
+            if fmt & 0x01:  # data length indicator
+                data = data[4:]
+            if fmt & 0x02:
+                data = _unsync(data)
+            if fmt & 0x08:
+                data = zlib.decompress(data)
+        else:
+            if fmt & 0x40 or fmt & 0x20:  # cifrato / group id
+                return None
+            if fmt & 0x80:
+                data = zlib.decompress(data[4:])
+    except zlib.error:
+        return None
+    return data
+
+# ------------------------
+# Decodifica frame
+# ------------------------
+ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+
+def _terminator(encoding: int) -> bytes:
+    return b"\x00\x00" if encoding in (1, 2) else b"\x00"
+
+
+def _split_string(data: bytes, encoding: int) -> tuple[bytes, bytes]:
+    """
+    Separa la prima stringa terminata da null dal resto
+    """
+    term = _terminator(encoding)
+    step = len(term)
+    index = 0
+    while True:
+        index = data.find(term, index)
+        if index < 0:
+            return data, b""
+        if index % step == 0:
+            return data[:index], data[index + step:]
+        index += 1
+
+
+def decode_text(data: bytes) -> list:
+    if not data:
+        return []
+    encoding = data[0]
+    if encoding not in ENCODINGS:
+        return []
+    text = data[1:].decode(ENCODINGS[encoding], errors="replace")
+    return [value for value in text.split("\x00") if value]
+
+
+def decode_txxx(data: bytes) -> tuple[str, str]:
+    if not data:
+        return "", ""
+    encoding = data[0]
+    desc, value = _split_string(data[1:], encoding)
+    codec = ENCODINGS.get(encoding, "latin-1")
+    return desc.decode(codec, errors="replace"), value.decode(codec, errors="replace").split("\x00")[0]
+
+
+def decode_apic(data: bytes) -> tuple[str, bytes]:
+    if len(data) < 2:
+        raise ID3Error("Frame APIC vuoto")
+    encoding = data[0]
+    mime, rest = _split_string(data[1:], 0)
+    _, picture = _split_string(rest[1:], encoding)
+    return mime.decode("latin-1") or "image/jpeg", picture
+
+def v23_recording_time(tag: Tag) -> str:
+    """
+    TYER (+ TDAT "DDMM" e TIME "HHMM") di un tag v2.3 nel formato di TDRC
+    """
+    year = tag.text("TYER").strip()[:4]
+    if not (len(year) == 4 and year.isdigit()):
+        return ""
+    value = year
+    date = tag.text("TDAT").strip()
+    if len(date) == 4 and date.isdigit():
+        value += f"-{date[2:]}-{date[:2]}"
+        clock = tag.text("TIME").strip()
+        if len(clock) == 4 and clock.isdigit():
+            value += f"T{clock[:2]}:{clock[2:]}"
+    return value
+
+# ------------------------
+# Codifica frame (ID3v2.4, UTF-8)
+# ------------------------
+def text_frame(frame_id: str, text: str) -> bytes:
+    return frame(frame_id, b"\x03" + text.encode("utf-8"))
+
+
+def txxx_frame(desc: str, text: str) -> bytes:
+    return frame("TXXX", b"\x03" + desc.encode("utf-8") + b"\x00" + text.encode("utf-8"))
+
+
+def apic_frame(mime: str, data: bytes, picture_type: int = 3, desc: str = "Cover") -> bytes:
+    return frame("APIC", b"\x03" + mime.encode("latin-1") + b"\x00" + bytes([picture_type]) + desc.encode("utf-8") + b"\x00" + data)
+
+
+def frame(frame_id: str, data: bytes) -> bytes:
+    return frame_id.encode("ascii") + _to_syncsafe(len(data)) + b"\x00\x00" + data
+
+# ------------------------
+# Scrittura
+# ------------------------
+def write_tag(path, frames: list, v1: dict | None = None):
+    """
+    Sostituisce il tag ID3v2 con i frame serializzati indicati.
+    Se il nuovo tag entra nello spazio del vecchio (padding compreso) viene
+    riscritta solo la testa del file; altrimenti il file viene ricopiato con
+    ID3_PADDING_KB di padding per le modifiche successive.
+    v1: campi per aggiornare un eventuale tag ID3v1 già presente.
+    """
+    body = b"".join(frames)
+    needed = HEADER_SIZE + len(body)
+
+    with open(path, "r+b") as f:
+        _, _, old_size = read_header(f)
+        spare = old_size - needed
+
+        in_place = 0 <= spare <= settings.ID3_MAX_PADDING_KB * 1024
+        if in_place:
+            # Solo la regione del tag viene mappata e riscritta
+            with mmap.mmap(f.fileno(), old_size) as region:
+                region[:] = _render(body, old_size)
+        else:
+            _rewrite(path, f, body, old_size)
+
+    if v1:
+        with open(path, "r+b") as f:
+            _update_v1(f, v1)
+
+
+def _render(body: bytes, total: int) -> bytes:
+    header = b"ID3\x04\x00\x00" + _to_syncsafe(total - HEADER_SIZE)
+    return header + body + b"\x00" * (total - HEADER_SIZE - len(body))
+
+
+def _rewrite(path, f, body: bytes, old_size: int):
+    total = HEADER_SIZE + len(body) + settings.ID3_PADDING_KB * 1024
+    tmp = f"{path}.tmp"
+    audio_size = os.fstat(f.fileno()).st_size - old_size
+    with open(tmp, "wb") as out:
+        out.write(_render(body, total))
+        out.flush()
+        copy_range(f.fileno(), out.fileno(), old_size, audio_size)
+    os.replace(tmp, path)
+
+
+def _update_v1(f, fields: dict):
+    f.seek(0, os.SEEK_END)
+    if f.tell() < 128:
+        return
+    f.seek(-128, os.SEEK_END)
+    v1 = bytearray(f.read(128))
+    if v1[:3] != b"TAG":
+        return
+
+    def put(offset, length, value):
+        if value is not None:
+            v1[offset:offset + length] = str(value).encode("latin-1", "replace")[:length].ljust(length, b"\x00")
+
+    put(3, 30, fields.get("title"))
+    put(33, 30, fields.get("artist"))
+    put(63, 30, fields.get("album"))
+    put(93, 4, fields.get("year"))
+    f.seek(-128, os.SEEK_END)
+    f.write(v1)
+
+# ------------------------
+# Durata da header MPEG
+# ------------------------
+BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+def _parse_frame_header(h: bytes):
+    """
+    (versione, layer, bitrate, samplerate, mono, lunghezza frame) oppure None
+    """
+    if h[0] != 0xFF or h[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 25, 2: 2, 3: 1}.get((h[1] >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((h[1] >> 1) & 0x03)
+    bitrate_index = h[2] >> 4
+    rate_index = (h[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (h[2] >> 1) & 0x01
+    mono = (h[3] >> 6) == 3
+
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return version, layer, bitrate, sample_rate, mono, length
+
+
+def audio_length(f, audio_start: int) -> float:
+    try:
+        return _audio_length(f, audio_start)
+    except (struct.error, IndexError):
+        raise ID3Error("Header Xing/VBRI troncato")
+
+
+def _audio_length(f, audio_start: int) -> float:
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(audio_start)
+    probe = f.read(PROBE_SIZE)
+
+    # Primo header valido seguito da un altro header valido
+    index = probe.find(b"\xff")
+    info = None
+    while 0 <= index <= len(probe) - 4:
+        info = _parse_frame_header(probe[index:index + 4])
+        if info:
+            following = probe[index + info[5]:index + info[5] + 4]
+            if len(following) < 4 or _parse_frame_header(following):
+                break
+        info = None
+        index = probe.find(b"\xff", index + 1)
+
+    if info is None:
+        raise ID3Error("Nessun frame MPEG trovato")
+
+    version, layer, bitrate, sample_rate, mono, _ = info
+    samples = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+    frame = probe[index:index + PROBE_SIZE]
+
+    # Xing / Info
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = 4 + side_info
+    if frame[xing:xing + 4] in (b"Xing", b"Info"):
+        xing_flags = struct.unpack(">I", frame[xing + 4:xing + 8])[0]
+        if xing_flags & 0x01:
+            frames = struct.unpack(">I", frame[xing + 8:xing + 12])[0]
+            lame = xing + 8 + (4 if xing_flags & 0x01 else 0) + (4 if xing_flags & 0x02 else 0) \
+                + (100 if xing_flags & 0x04 else 0) + (4 if xing_flags & 0x08 else 0)
+            delay = padding = 0
+            if frame[lame:lame + 4] == b"LAME":
+                d = frame[lame + 21:lame + 24]
+                delay = (d[0] << 4) | (d[1] >> 4)
+                padding = ((d[1] & 0x0F) << 8) | d[2]
+            return max(frames * samples - delay - padding, 0) / sample_rate
+
+    # VBRI (Fraunhofer)
+    if frame[36:40] == b"VBRI":
+        frames = struct.unpack(">I", frame[50:54])[0]
+        return frames * samples / sample_rate
+
+    # CBR: stima dalla dimensione dei dati audio (escluso un eventuale ID3v1)
+    v1 = 0
+    if file_size - audio_start - index >= 128:
+        f.seek(-128, os.SEEK_END)
+        v1 = 128 if f.read(3) == b"TAG" else 0
+    return (file_size - audio_start - index - v1) * 8 / bitrate
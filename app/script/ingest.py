@@ -0,0 +1,198 @@
+import os
+import uuid
+import asyncio
+import tarfile
+import zipfile
+from functools import partial
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from app.script.settings import settings
+from app.script.fileio import real_fileno, copy_range
+
+# ------------------------
+# Validazione header MP3
+# ------------------------
+def is_mp3_header(chunk: bytes) -> bool:
+    """
+    Controlla i primi byte del file: tag ID3v2 oppure sync di un frame MPEG audio
+    """
+    if chunk[:3] == b"ID3":
+        return True
+
+    if len(chunk) < 4:
+        return False
+
+    # Frame sync (11 bit a 1), versione e layer validi, bitrate e samplerate non riservati
+    b1, b2 = chunk[1], chunk[2]
+    return (
+        chunk[0] == 0xFF
+        and (b1 & 0xE0) == 0xE0
+        and (b1 >> 3) & 0x03 != 0x01
+        and (b1 >> 1) & 0x03 != 0x00
+        and (b2 >> 4) != 0x0F
+        and (b2 >> 2) & 0x03 != 0x03
+    )
+
+# ------------------------
+# Salvataggio a blocchi
+# ------------------------
+def save_upload(source, dest: Path, max_size: int, chunk_size: int) -> int:
+    """
+    Copia il file caricato su disco a blocchi di chunk_size byte.
+    Il primo blocco viene validato prima di scrivere in dest, la copia si
+    interrompe appena la dimensione supera max_size. Entrambi i controlli
+    avvengono dopo che Starlette ha ricevuto tutto il corpo multipart
+    (in memoria o nel suo file temporaneo): evitano la copia in
+    UPLOAD_DIR, non la ricezione.
+    Se l'upload è già su disco il resto viene copiato con copy_file_range/sendfile.
+    Ritorna il numero di byte scritti, solleva ValueError se il file non è valido.
+    """
+    first = source.read(chunk_size)
+    if not first or not is_mp3_header(first):
+        raise ValueError("il contenuto non è un MP3 valido")
+
+    written = 0
+    try:
+        with open(dest, "wb") as out:
+            # Upload già su disco (spooled file oltre la soglia): copia nel kernel
+            src_fd = real_fileno(source)
+            if src_fd is not None:
+                offset = source.tell()
+                written = len(first) + os.fstat(src_fd).st_size - offset
+                if written > max_size:
+                    raise ValueError("file troppo grande")
+                out.write(first)
+                out.flush()
+                copy_range(src_fd, out.fileno(), offset, written - len(first))
+                return written
+
+            chunk = first
+            while chunk:
+                written += len(chunk)
+                if written > max_size:
+                    raise ValueError("file troppo grande")
+                out.write(chunk)
+                chunk = source.read(chunk_size)
+    except BaseException:
+        # Nessun file parziale lasciato in UPLOAD_DIR
+        try:
+            os.unlink(dest)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return written
+
+# ------------------------
+# Archivi (bulk ingest)
+# ------------------------
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _archive_members(source, filename: str):
+    """
+    (nome, file) per ogni MP3 dell'archivio; i tar vengono letti in streaming
+    """
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(".mp3"):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        return
+
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for info in archive:
+            if info.isfile() and info.name.lower().endswith(".mp3"):
+                member = archive.extractfile(info)
+                if member is not None:
+                    yield info.name, member
+
+
+def extract_archive(source, filename: str, dest_dir: Path, max_size: int, chunk_size: int, max_files: int):
+    """
+    Estrae gli MP3 di un archivio zip/tar in dest_dir, validandoli come save_upload.
+    Ritorna una lista di (nome originale, nome salvato, dimensione, errore).
+    """
+    results = []
+    try:
+        for name, member in _archive_members(source, filename):
+            if len(results) >= max_files:
+                results.append((filename, None, 0, f"oltre {max_files} file, archivio troncato"))
+                break
+            original = Path(name).name
+            saved = f"{uuid.uuid4()}_{original}"
+            try:
+                size = save_upload(member, dest_dir / saved, max_size, chunk_size)
+            except ValueError as e:
+                results.append((original, None, 0, str(e)))
+                continue
+            results.append((original, saved, size, None))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        results.append((filename, None, 0, f"archivio non valido - {e}"))
+    return results
+
+# ------------------------
+# Raggruppamento per album
+# ------------------------
+def _group_key(text: str) -> str:
+    return " ".join((text or "").casefold().split())
+
+
+def group_albums(items: list) -> list:
+    """
+    items: (metadata, track) già estratti.
+    Raggruppa per artista dell'album (o artista), album e disco, nell'ordine
+    in cui compaiono; le tracce di ogni gruppo sono ordinate per numero.
+    """
+    groups = {}
+    for metadata, track in items:
+        artist = metadata.get("album_artist") or metadata.get("artist") or ""
+        album = metadata.get("album") or ""
+        disc = metadata.get("disc_number")
+        key = (_group_key(artist), _group_key(album), disc)
+        group = groups.setdefault(key, {
+            "artist": artist,
+            "album": album,
+            "disc": disc,
+            "genre": metadata.get("genre") or "",
+            "release_date": metadata.get("release_date") or "",
+            "tracks": [],
+        })
+        group["tracks"].append(track)
+
+    for group in groups.values():
+        group["tracks"].sort(key=lambda t: (t.get("track_number") is None, t.get("track_number") or 0))
+    return list(groups.values())
+
+# ------------------------
+# Pool di elaborazione
+# ------------------------
+_pool = None
+
+def get_ingest_pool():
+    """
+    Pool condiviso per l'elaborazione delle tracce (thread o processi, da INGEST_POOL)
+    """
+    global _pool
+    if _pool is None:
+        if settings.INGEST_POOL == "process":
+            _pool = ProcessPoolExecutor(max_workers=settings.INGEST_WORKERS)
+        else:
+            _pool = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+    return _pool
+
+async def run_in_ingest_pool(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_ingest_pool(), partial(func, *args, **kwargs))
+
+def shutdown_ingest_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
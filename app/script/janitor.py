@@ -0,0 +1,231 @@
+import os
+import time
+import asyncio
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+from app.script.settings import settings
+from app.script.state import get_state
+
+# ------------------------
+# File temporanei di upload
+# ------------------------
+# Ogni chiamata a upload-temp registra i propri file in un batch con
+# scadenza. Lo sweeper periodico elimina i batch scaduti; i file caricati
+# con successo vengono eliminati subito.
+# I file in uso da un job (claim) non vengono mai eliminati; il claim è
+# registrato anche nello stato condiviso perché upload-temp e upload-final
+# possono arrivare a worker diversi (una sola chiamata per tutti i file,
+# in un thread quando parte dall'event loop). Per lo stesso motivo release()
+# prolunga la scadenza aggiornando la data di modifica dei file, visibile
+# al worker che li ha registrati.
+# TEMP_MAX_MB è verificato a ogni sweep sulla dimensione reale di
+# UPLOAD_DIR (condivisa da tutti i worker): oltre il limite si eliminano i
+# file non in uso più vecchi. Tra due sweep il limite può essere superato.
+CLAIM_TTL = 86400
+
+
+class TempJanitor:
+
+    def __init__(self, directory: Path, ttl: int, max_bytes: int, interval: int):
+        self.dir = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.total = 0  # dimensione di UPLOAD_DIR all'ultimo sweep
+        self._batches = OrderedDict()  # batch -> {"files": {nome: dimensione}, "expires": ts}
+        self._owner = {}               # nome -> batch
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._task = None
+
+    # Registrazione
+    def register(self, batch: str, name: str, size: int):
+        with self._lock:
+            entry = self._batches.setdefault(batch, {"files": {}, "expires": 0})
+            entry["files"][name] = size
+            entry["expires"] = time.time() + self.ttl
+            self._batches.move_to_end(batch)
+            self._owner[name] = batch
+
+    async def claim(self, names: list):
+        """
+        Protegge i file di un job fino a release()
+        """
+        with self._lock:
+            self._claimed.update(names)
+        await asyncio.to_thread(get_state().set_many, {f"temp-claim:{name}": 1 for name in names}, CLAIM_TTL)
+
+    async def release(self, names: list):
+        """
+        Fine del job: i file rimasti (upload falliti) restano disponibili
+        per un nuovo tentativo fino alla scadenza del batch
+        """
+        await asyncio.to_thread(self._release_files, names)
+        with self._lock:
+            self._claimed.difference_update(names)
+            for name in names:
+                batch = self._owner.get(name)
+                if batch in self._batches:
+                    self._batches[batch]["expires"] = time.time() + self.ttl
+
+    def _release_files(self, names: list):
+        get_state().delete_many([f"temp-claim:{name}" for name in names])
+        now = time.time()
+        for name in names:
+            try:
+                os.utime(self.dir / name, (now, now))
+            except FileNotFoundError:
+                pass
+
+    # Eliminazione
+    def discard(self, name: str):
+        """
+        Elimina subito un file (es. dopo l'upload SFTP riuscito, dal thread dell'upload)
+        """
+        self._discard_files([name])
+
+    async def discard_many(self, names: list):
+        await asyncio.to_thread(self._discard_files, names)
+
+    def _discard_files(self, names: list):
+        get_state().delete_many([f"temp-claim:{name}" for name in names])
+        with self._lock:
+            for name in names:
+                self._claimed.discard(name)
+                self._forget(name)
+        for name in names:
+            self._unlink(name)
+
+    def _forget(self, name: str):
+        batch = self._owner.pop(name, None)
+        entry = self._batches.get(batch)
+        if entry is None:
+            return
+        entry["files"].pop(name, None)
+        if not entry["files"]:
+            del self._batches[batch]
+
+    def _unlink(self, name: str):
+        try:
+            (self.dir / name).unlink(missing_ok=True)
+        except Exception as e:
+            print(f"Errore cancellando {name}: {e}")
+
+    def _in_use(self, names: list) -> set:
+        """
+        File in uso da un job di questo o di un altro worker
+        """
+        claimed = get_state().get_many([f"temp-claim:{name}" for name in names if name not in self._claimed])
+        return {name for name in names if name in self._claimed or f"temp-claim:{name}" in claimed}
+
+    def _expired(self, name: str, now: float) -> bool:
+        # Data di modifica aggiornata da release() su qualsiasi worker
+        try:
+            return (self.dir / name).stat().st_mtime + self.ttl < now
+        except FileNotFoundError:
+            return True  # già eliminato (es. discard su un altro worker)
+
+    def _drop_batch(self, batch: str, now: float) -> list:
+        """
+        Rimuove dal registro i file scaduti e non in uso del batch e li ritorna
+        """
+        entry = self._batches[batch]
+        expired = [n for n in entry["files"] if self._expired(n, now)]
+        in_use = self._in_use(expired)
+        names = [n for n in expired if n not in in_use]
+        for name in names:
+            self._forget(name)
+        return names
+
+    def _disk_files(self) -> list:
+        """
+        (data di modifica, dimensione, nome) dei file in UPLOAD_DIR, dal più vecchio
+        """
+        files = []
+        with os.scandir(self.dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.name))
+                except FileNotFoundError:
+                    pass
+        files.sort()
+        return files
+
+    def _enforce_cap(self) -> list:
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        removed = []
+        in_use = self._in_use([name for _, _, name in files]) if total > self.max_bytes else set()
+        for _, size, name in files:
+            if total <= self.max_bytes:
+                break
+            if name in in_use:
+                continue
+            removed.append(name)
+            total -= size
+        self.total = total
+        with self._lock:
+            for name in removed:
+                self._forget(name)
+        return removed
+
+    def sweep(self) -> int:
+        now = time.time()
+        removed = []
+        with self._lock:
+            for batch, entry in list(self._batches.items()):
+                if entry["expires"] < now:
+                    removed += self._drop_batch(batch, now)
+        if self.dir.is_dir():
+            removed += self._enforce_cap()
+        for name in removed:
+            self._unlink(name)
+        return len(removed)
+
+    def adopt_existing(self):
+        """
+        All'avvio registra i file rimasti da un'esecuzione precedente,
+        con scadenza calcolata dalla data di modifica
+        """
+        if not self.dir.is_dir():
+            return
+        for f in self.dir.iterdir():
+            if f.is_file():
+                stat = f.stat()
+                self.register("startup", f.name, stat.st_size)
+                self._batches["startup"]["expires"] = min(
+                    self._batches["startup"]["expires"], stat.st_mtime + self.ttl
+                )
+
+    # Sweeper periodico
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"Errore durante la pulizia dei file temporanei: {e}")
+
+    def start(self):
+        self.adopt_existing()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+temp_janitor = TempJanitor(
+    directory=Path(settings.UPLOAD_DIR).resolve(),
+    ttl=settings.TEMP_TTL,
+    max_bytes=settings.TEMP_MAX_MB * 1024 * 1024,
+    interval=settings.TEMP_SWEEP_INTERVAL,
+)
@@ -0,0 +1,134 @@
+import copy
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+from app.script.settings import settings
+from app.script.state import get_state
+
+# ------------------------
+# Job in background
+# ------------------------
+# Stati job: queued -> running -> done | failed
+# Stati traccia: pending -> tagging -> ready -> uploading -> done | error
+# Ogni job è pubblicato anche nello stato condiviso, così che /api/jobs
+# risponda da qualsiasi worker e non solo da quello che lo esegue.
+# Le scritture sullo stato condiviso avvengono in un thread e solo se il
+# job è cambiato dall'ultima pubblicazione.
+JOBS = OrderedDict()
+PUBLISH_INTERVAL = 0.5
+
+_queue = None
+_worker = None
+_published = {}  # id job -> copia dell'ultima versione pubblicata
+
+
+async def create_job(album: str, tracks: list, albums: list | None = None) -> dict:
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "album": album,
+        "created": time.time(),
+        "finished": None,
+        "message": None,
+        "errors": [],
+        "tracks": [
+            {
+                "temp_file": t.get("temp_file"),
+                "title": t.get("title"),
+                "state": "pending",
+                "bytes_sent": 0,
+                "bytes_total": 0,
+                "remote_path": None,
+                "error": None,
+            }
+            for t in tracks
+        ],
+    }
+
+    # Bulk ingest: un job per più album, con stato per album
+    if albums is not None:
+        job["albums"] = albums
+
+    JOBS[job["id"]] = job
+
+    # Mantiene solo gli ultimi JOBS_HISTORY job: i più vecchi tra quelli
+    # conclusi, mai un job in coda o in esecuzione
+    finished = [job_id for job_id, old in JOBS.items() if old["status"] in ("done", "failed")]
+    for old_id in finished[:max(len(JOBS) - settings.JOBS_HISTORY, 0)]:
+        del JOBS[old_id]
+        _published.pop(old_id, None)
+
+    await publish_job(job)
+    return job
+
+
+async def publish_job(job: dict):
+    # Copia fatta nel loop: il thread non vede il job mentre viene modificato
+    snapshot = copy.deepcopy(job)
+    if _published.get(job["id"]) == snapshot:
+        return
+    await asyncio.to_thread(get_state().set, f"job:{job['id']}", snapshot, ttl=settings.JOB_TTL)
+    if job["id"] in JOBS:
+        _published[job["id"]] = snapshot
+
+
+async def get_job(job_id: str) -> dict | None:
+    job = JOBS.get(job_id)
+    if job is None:
+        job = await asyncio.to_thread(get_state().get, f"job:{job_id}")
+    return job
+
+
+async def submit_job(job: dict, func, *args):
+    """
+    Accoda func(job, *args): i job vengono eseguiti uno alla volta dal worker
+    """
+    await _queue.put((job, func, args))
+
+
+async def _publish_running(job: dict):
+    # Avanzamento per traccia visibile agli altri worker
+    while True:
+        await asyncio.sleep(PUBLISH_INTERVAL)
+        try:
+            await publish_job(job)
+        except Exception as e:
+            print(f"Errore pubblicando il job {job['id']}: {e}")
+
+
+async def _run_worker():
+    while True:
+        job, func, args = await _queue.get()
+        job["status"] = "running"
+        publisher = asyncio.create_task(_publish_running(job))
+        try:
+            await func(job, *args)
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["errors"].append(f"Errore durante l'elaborazione: {str(e)}")
+        finally:
+            publisher.cancel()
+            job["finished"] = time.time()
+            try:
+                await publish_job(job)
+            except Exception as e:
+                print(f"Errore pubblicando il job {job['id']}: {e}")
+            _queue.task_done()
+
+
+def start_worker():
+    global _queue, _worker
+    _queue = asyncio.Queue()
+    _worker = asyncio.create_task(_run_worker())
+
+
+async def stop_worker():
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
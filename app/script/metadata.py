@@ -1,107 +1,277 @@
-import base64
-from mutagen.id3 import ID3, TIT2, TPE1, TPE2, TALB, TCON, TDRC, TCOM, APIC, TXXX, TRCK, TCMP, TPOS
-from mutagen.mp3 import MP3
+from app.script import id3
+from app.script.covers import normalize_cover
+
+# ------------------------
+# Lettura/scrittura tag
+# ------------------------
+# I tag vengono letti e scritti direttamente con app.script.id3, che tocca
+# solo la testa del file (tag ID3v2) e il primo frame MPEG per la durata.
+# Per i file che il motore non gestisce (ID3v2.2, tag corrotti, stream non
+# MPEG) si ripiega su mutagen, importato solo quando serve.
+
+# Frame riscritti ad ogni aggiornamento; tutti gli altri vengono conservati
+REPLACED_FRAMES = {
+    "TPE1", "TPE2", "TCOM",
+    "TALB", "TIT2", "TCON",
+    "TDRC", "TRCK", "TCMP",
+    "TXXX", "APIC",
+}
+
+# Bulk ingest: solo i campi dell'album, i tag della traccia restano intatti
+ALBUM_FRAMES = {"TPE2", "TALB", "TPOS"}
+
+
+def parse_track_number(raw) -> int | None:
+    # TRCK/TPOS (o il form) può essere 5, "5" oppure "5/12"; None se non numerico ("A1")
+    number = str(raw or "").split("/")[0].strip()
+    return int(number) if number.isdigit() else None
 
 # ------------------------
 # Estrazione metadati
 # ------------------------
-def extract_metadata(file_path: str):
-    audio = MP3(file_path, ID3=ID3)
-    
-    # Extract track number (TRCK can be "5" or "5/12" format)
-    track_number = None
+def extract_metadata(file_path: str, include_cover: bool = False):
+    """
+    La copertina viene letta solo se include_cover è True e restituita
+    come {"mime", "data"} con i byte originali.
+    """
     try:
-        track_num_raw = str(audio.get("TRCK", [""])[0])
-        if track_num_raw:
-            track_number = int(track_num_raw.split("/")[0]) if track_num_raw.split("/")[0].isdigit() else None
-    except Exception: pass
-    
+        with open(file_path, "rb") as f:
+            tag = id3.read_tag(f, include_pictures=include_cover)
+            duration = id3.audio_length(f, tag.size)
+    except id3.ID3Error:
+        return _extract_mutagen(file_path, include_cover)
+
+    metadata = {
+        "title": tag.text("TIT2"),
+        "artist": tag.text("TPE1"),
+        "album": tag.text("TALB"),
+        "album_artist": tag.text("TPE2"),
+        "disc_number": parse_track_number(tag.text("TPOS")),
+        "duration": int(duration),
+        "genre": tag.text("TCON"),
+        "release_date": tag.text("TDRC") or tag.text("TYER"),
+        "track_number": parse_track_number(tag.text("TRCK")),
+        "cover": None
+    }
+
+    if include_cover:
+        picture = tag.picture()
+        if picture:
+            mime, data = picture
+            metadata["cover"] = {"mime": mime, "data": data}
+
+    return metadata
+
+
+def _extract_mutagen(file_path: str, include_cover: bool):
+    from mutagen.id3 import ID3
+    from mutagen.mp3 import MP3
+
+    audio = MP3(file_path, ID3=ID3)
+
     metadata = {
         "title": str(audio.get("TIT2", [""])[0]),
         "artist": str(audio.get("TPE1", [""])[0]),
         "album": str(audio.get("TALB", [""])[0]),
+        "album_artist": str(audio.get("TPE2", [""])[0]),
+        "disc_number": parse_track_number(str(audio.get("TPOS", [""])[0])),
         "duration": int(audio.info.length),
         "genre": str(audio.get("TCON", [""])[0]),
         "release_date": str(audio.get("TDRC", [""])[0]),
-        "track_number": track_number,
+        "track_number": parse_track_number(str(audio.get("TRCK", [""])[0])),
         "cover": None
     }
 
-    # Estrazione e codifica in base64 della copertina (se presente)
-    if audio.tags:
-        for tag in audio.tags.values():
-            if isinstance(tag, APIC):
-                img_data = tag.data
-                mime = tag.mime
-                metadata["cover"] = (
-                    f"data:{mime};base64,"
-                    f"{base64.b64encode(img_data).decode()}"
-                )
-                break
-        
+    if include_cover and audio.tags:
+        apic = audio.tags.getall("APIC")
+        if apic:
+            metadata["cover"] = {"mime": apic[0].mime, "data": apic[0].data}
+
     return metadata
 
 # ------------------------
 # Aggiornamento metadati
 # ------------------------
+def prepare_cover(cover_data: bytes) -> dict:
+    """
+    Copertina dell'album normalizzata una sola volta, con il frame APIC già
+    serializzato da riutilizzare per tutte le tracce.
+    """
+    mime, data = normalize_cover(cover_data)
+    return {"mime": mime, "data": data, "frame": id3.apic_frame(mime, data)}
+
+
+def update_metadata(file_path, data, cover=None, album_only=False):
+    """
+    cover: copertina restituita da prepare_cover
+    album_only: scrive solo artista dell'album, album, disco e copertina
+    (se presente); artista, compositore e gli altri tag della traccia restano
+    """
+    try:
+        with open(file_path, "rb") as f:
+            tag = id3.read_tag(f, include_pictures=False)
+    except id3.ID3Error:
+        return _update_mutagen(file_path, data, cover, album_only)
+
+    if album_only:
+        return _update_album(file_path, tag, data, cover)
+
+    artist = data.get("artist")
+    album = data.get("album")
+
+    # Frame esistenti da conservare (il tag viene sempre scritto in v2.4);
+    # la data esistente resta se il form non ne indica una
+    frames = [
+        id3.frame(fid, frame_data)
+        for fid, frame_data in _existing_frames(tag)
+        if fid not in REPLACED_FRAMES or (fid == "TDRC" and not data.get("release_date"))
+    ]
+
+    # Titolo (TIT2)
+    if data.get("title"):
+        frames.append(id3.text_frame("TIT2", data["title"]))
+
+    # Artisti: brano, album, compositore
+    if artist:
+        frames.append(id3.text_frame("TPE1", artist))
+        frames.append(id3.text_frame("TPE2", artist))
+        frames.append(id3.text_frame("TCOM", artist))
+        frames.append(id3.txxx_frame("ALBUMARTIST", artist))
+
+    # Album (TALB)
+    if album:
+        frames.append(id3.text_frame("TALB", album))
+
+    # Genere (TCON)
+    if data.get("genre"):
+        frames.append(id3.text_frame("TCON", data["genre"]))
+
+    # Data di rilascio (TDRC)
+    if data.get("release_date"):
+        frames.append(id3.text_frame("TDRC", data["release_date"]))
+
+    # Track number (TRCK)
+    if data.get("track_number"):
+        frames.append(id3.text_frame("TRCK", str(data["track_number"])))
+
+    # Cover (APIC), in fondo al tag
+    if cover:
+        frames.append(cover["frame"])
+
+    # Un eventuale ID3v1 esistente viene allineato
+    id3.write_tag(file_path, frames, v1={
+        "title": data.get("title"),
+        "artist": artist,
+        "album": album,
+        "year": (data.get("release_date") or "")[:4] or None,
+    })
+
+
+def _existing_frames(tag) -> list:
+    # Frame da riscrivere in v2.4: quelli solo v2.3 vengono rinominati o
+    # scartati, l'anno (TYER/TDAT/TIME) diventa TDRC
+    frames = []
+    for fid, frame_data in tag.frames:
+        if tag.version == 3:
+            if fid in id3.V23_DROPPED:
+                continue
+            fid = id3.V23_RENAMED.get(fid, fid)
+        frames.append((fid, frame_data))
+    if tag.version == 3 and not tag.get("TDRC"):
+        recorded = id3.v23_recording_time(tag)
+        if recorded:
+            frames.append(("TDRC", b"\x03" + recorded.encode("utf-8")))
+    return frames
+
+
+def _update_album(file_path, tag, data, cover=None):
+    artist = data.get("artist")
+    album = data.get("album")
+
+    frames = []
+    for fid, frame_data in _existing_frames(tag):
+        if fid in ALBUM_FRAMES or (cover and fid == "APIC"):
+            continue
+        if fid == "TXXX" and id3.decode_txxx(frame_data)[0] == "ALBUMARTIST":
+            continue
+        frames.append(id3.frame(fid, frame_data))
+
+    if artist:
+        frames.append(id3.text_frame("TPE2", artist))
+        frames.append(id3.txxx_frame("ALBUMARTIST", artist))
+    if album:
+        frames.append(id3.text_frame("TALB", album))
+    if data.get("disc"):
+        frames.append(id3.text_frame("TPOS", str(data["disc"])))
+    if cover:
+        frames.append(cover["frame"])
+
+    id3.write_tag(file_path, frames, v1={"album": album})
+
+
+def _update_mutagen(file_path, data, cover=None, album_only=False):
+    from mutagen.id3 import ID3, TIT2, TPE1, TPE2, TALB, TCON, TDRC, TCOM, APIC, TXXX, TRCK, TPOS
+    from mutagen.mp3 import MP3
 
-def update_metadata(file_path, data, cover_data=None):
     # Carica il file MP3 con ID3
     audio = MP3(file_path, ID3=ID3)
 
     # Aggiungi o aggiorna i metadati ID3
     audio.tags = audio.tags or ID3()
-    
+
     artist = data.get("artist")
     album = data.get("album")
-    
+
+    if album_only:
+        for tag in ALBUM_FRAMES:
+            audio.tags.delall(tag)
+        audio.tags.delall("TXXX:ALBUMARTIST")
+        if artist:
+            audio["TPE2"] = TPE2(encoding=3, text=artist)
+            audio["TXXX:ALBUMARTIST"] = TXXX(encoding=3, desc="ALBUMARTIST", text=artist)
+        if album:
+            audio["TALB"] = TALB(encoding=3, text=album)
+        if data.get("disc"):
+            audio["TPOS"] = TPOS(encoding=3, text=str(data["disc"]))
+        if cover:
+            audio.tags.delall("APIC")
+            audio["APIC"] = APIC(encoding=3, mime=cover["mime"], type=3, desc="Cover", data=cover["data"])
+        audio.save()
+        return
+
     # Rimozione campi esistenti
-    for tag in [
-        "TPE1", "TPE2", "TCOM",
-        "TALB", "TIT2", "TCON",
-        "TDRC", "TRCK", "TCMP"
-    ]:
+    for tag in REPLACED_FRAMES:
         audio.tags.delall(tag)
 
-    audio.tags.delall("TXXX")
-    audio.tags.delall("APIC")
-
-    # Titolo (TIT2)
     if data.get("title"):
         audio["TIT2"] = TIT2(encoding=3, text=data["title"])
 
-    # Artisti
     if artist:
-        audio["TPE1"] = TPE1(encoding=3, text=artist)  # artista brano
-        audio["TPE2"] = TPE2(encoding=3, text=artist)  # artista album
-        audio["TCOM"] = TCOM(encoding=3, text=artist)  # compositore
+        audio["TPE1"] = TPE1(encoding=3, text=artist)
+        audio["TPE2"] = TPE2(encoding=3, text=artist)
+        audio["TCOM"] = TCOM(encoding=3, text=artist)
         audio["TXXX:ALBUMARTIST"] = TXXX(encoding=3, desc="ALBUMARTIST", text=artist)
 
-    # Album (TALB)
     if album:
         audio["TALB"] = TALB(encoding=3, text=album)
-    
-    # Genere (TCON)
+
     if data.get("genre"):
         audio["TCON"] = TCON(encoding=3, text=data["genre"])
 
-    # Data di rilascio (TDRC)
     if data.get("release_date"):
         audio["TDRC"] = TDRC(encoding=3, text=data["release_date"])
 
-    # Track number (TRCK)
     if data.get("track_number"):
         audio["TRCK"] = TRCK(encoding=3, text=str(data["track_number"]))
-    
-    # Cover (APIC)
-    if cover_data:
+
+    if cover:
         audio["APIC"] = APIC(
             encoding=3,  # UTF-8
-            mime="image/jpeg",
+            mime=cover["mime"],
             type=3,  # Copertina frontale
             desc="Cover",
-            data=cover_data
+            data=cover["data"]
         )
 
     # Salva i metadati nel file audio
-    audio.save()
\ No newline at end of file
+    audio.save()
@@ -0,0 +1,135 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+from app.script.settings import settings
+
+# ------------------------
+# Metriche Prometheus
+# ------------------------
+# Contatori e istogrammi in memoria del processo, esposti su /metrics.
+# Lo stato di cache, pool SFTP, job e file temporanei viene letto solo
+# quando Prometheus interroga l'endpoint (StateCollector).
+# Con più worker prometheus_client lavora in modalità multiprocesso: ogni
+# worker scrive contatori e istogrammi in PROMETHEUS_MULTIPROC_DIR (letta
+# all'import, va impostata prima dell'avvio) e /metrics li somma tutti.
+# I valori di StateCollector restano quelli del worker che risponde.
+MULTIPROCESS = settings.WORKERS > 1 and bool(settings.PROMETHEUS_MULTIPROC_DIR)
+if settings.WORKERS > 1 and not MULTIPROCESS:
+    print("PROMETHEUS_MULTIPROC_DIR non impostata: /metrics riporta solo il worker che risponde")
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram(
+    "coemify_request_seconds", "Durata delle richieste HTTP per route",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "coemify_stage_seconds", "Durata delle fasi della pipeline di upload",
+    ["stage"], buckets=STAGE_BUCKETS,
+)
+STAGE_BYTES = Counter(
+    "coemify_bytes_total", "Byte ricevuti dal browser (in) e inviati via SFTP (out)",
+    ["direction"],
+)
+NAVIDROME_SECONDS = Histogram(
+    "coemify_navidrome_seconds", "Latenza delle chiamate a Navidrome per scope",
+    ["scope"],
+)
+COVER_REQUESTS = Counter(
+    "coemify_cover_requests_total", "Richieste copertine: cache, attesa di una fetch in corso o download",
+    ["result"],
+)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage: str, started: float):
+    STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+class StateCollector:
+    """
+    Gauge calcolati al momento dello scrape
+    """
+
+    def describe(self):
+        # Evita che la registrazione chiami collect() prima che i moduli siano caricati
+        return []
+
+    def collect(self):
+        # Import locali: i moduli osservati importano a loro volta le metriche
+        from app.script.apis import navidrome_cache
+        from app.script.ssh_utils import sftp_pool
+        from app.script.jobs import JOBS
+        from app.script.janitor import temp_janitor
+
+        hits = CounterMetricFamily("coemify_navidrome_cache", "Letture dalla cache Navidrome", labels=["result"])
+        hits.add_metric(["hit"], navidrome_cache.hits)
+        hits.add_metric(["miss"], navidrome_cache.misses)
+        yield hits
+        yield GaugeMetricFamily("coemify_navidrome_cache_entries", "Voci nella cache Navidrome", value=len(navidrome_cache))
+
+        pool = GaugeMetricFamily("coemify_sftp_channels", "Canali SFTP del pool", labels=["state"])
+        pool.add_metric(["in_use"], sftp_pool.in_use)
+        pool.add_metric(["idle"], len(sftp_pool._idle))
+        pool.add_metric(["max"], sftp_pool.size)
+        yield pool
+
+        jobs = GaugeMetricFamily("coemify_jobs", "Job di upload per stato", labels=["status"])
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for job in list(JOBS.values()):
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        for status, count in counts.items():
+            jobs.add_metric([status], count)
+        yield jobs
+
+        yield GaugeMetricFamily("coemify_temp_bytes", "Byte dei file temporanei di upload", value=temp_janitor.total)
+
+
+REGISTRY.register(StateCollector())
+
+# ------------------------
+# Middleware e endpoint
+# ------------------------
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        start = time.perf_counter()
+        request.state.started = start
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Template della route (es. /api/jobs/{job_id}) per non moltiplicare le serie
+            route = request.scope.get("route")
+            path = getattr(route, "path", "other")
+            REQUEST_SECONDS.labels(request.method, path, str(status)).observe(time.perf_counter() - start)
+
+
+def _registry():
+    if not MULTIPROCESS:
+        return REGISTRY
+    from prometheus_client import multiprocess
+
+    # Registro nuovo ad ogni scrape, come da documentazione di prometheus_client
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(StateCollector())
+    return registry
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
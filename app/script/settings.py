@@ -23,6 +23,18 @@ class Settings:
     # ===== Upload =====
     MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB"))
     UPLOAD_DIR = os.getenv("UPLOAD_DIR")
+    UPLOAD_CHUNK_SIZE_KB = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "1024"))
+    INGEST_POOL = os.getenv("INGEST_POOL", "thread")  # thread | process
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "8"))
+    ID3_PADDING_KB = int(os.getenv("ID3_PADDING_KB", "16"))
+    ID3_MAX_PADDING_KB = int(os.getenv("ID3_MAX_PADDING_KB", "1024"))
+    BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "1000"))
+    BULK_ALBUM_CONCURRENCY = int(os.getenv("BULK_ALBUM_CONCURRENCY", "2"))
+    JOBS_HISTORY = int(os.getenv("JOBS_HISTORY", "50"))
+    TEMP_TTL = int(os.getenv("TEMP_TTL", "600"))
+    TEMP_MAX_MB = int(os.getenv("TEMP_MAX_MB", "2048"))
+    TEMP_SWEEP_INTERVAL = int(os.getenv("TEMP_SWEEP_INTERVAL", "60"))
     ALLOWED_MIME_PREFIX = os.getenv("ALLOWED_MIME_PREFIX")
 
     # ===== Server =====
@@ -30,6 +42,24 @@ class Settings:
     PORT = int(os.getenv("PORT"))
     WORKERS = int(os.getenv("WORKERS"))
 
+    # ===== Avvio a freddo =====
+    STARTUP_REPORT = os.getenv("STARTUP_REPORT", "false") == "true"
+    STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true") == "true"
+    STARTUP_WARMUP_DELAY = float(os.getenv("STARTUP_WARMUP_DELAY", "3"))
+    TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "template_cache")
+
+    # ===== Metriche =====
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # Bearer per Prometheus; "" = solo utenti loggati
+    # Con WORKERS > 1: cartella condivisa dei contatori, svuotata prima dell'avvio (vedi Dockerfile)
+    PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+    # ===== Stato condiviso tra worker =====
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")  # sqlite | redis
+    STATE_FILE = os.getenv("STATE_FILE", "coemify_state.db")
+    STATE_URL = os.getenv("STATE_URL", "redis://localhost:6379/0")
+    JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+    FINGERPRINT_FILE = os.getenv("FINGERPRINT_FILE", "coemify_fingerprints.db")
+
     # ===== Rate limiting =====
     LOGIN_RATE_LIMIT = os.getenv("LOGIN_RATE_LIMIT")
     UPLOAD_RATE_LIMIT = os.getenv("UPLOAD_RATE_LIMIT")
@@ -38,12 +68,34 @@ class Settings:
     NAVIDROME_URL = os.getenv("NAVIDROME_URL")
     NAVIDROME_USER = os.getenv("NAVIDROME_USER")
     NAVIDROME_PASS = os.getenv("NAVIDROME_PASS")
+    NAVIDROME_TIMEOUT = float(os.getenv("NAVIDROME_TIMEOUT", "5"))
+    NAVIDROME_MAX_CONNECTIONS = int(os.getenv("NAVIDROME_MAX_CONNECTIONS", "10"))
+    NAVIDROME_CONCURRENCY = int(os.getenv("NAVIDROME_CONCURRENCY", "8"))
+    NAVIDROME_CACHE_TTL = int(os.getenv("NAVIDROME_CACHE_TTL", "300"))
+    NAVIDROME_CACHE_STALE = int(os.getenv("NAVIDROME_CACHE_STALE", "3600"))
+    NAVIDROME_CACHE_SIZE = int(os.getenv("NAVIDROME_CACHE_SIZE", "256"))
+    CATALOG_SYNC_INTERVAL = int(os.getenv("CATALOG_SYNC_INTERVAL", "300"))
+    CATALOG_FULL_SYNC_INTERVAL = int(os.getenv("CATALOG_FULL_SYNC_INTERVAL", "86400"))
+    CATALOG_FILE = os.getenv("CATALOG_FILE", "coemify_catalog.json")  # "" per disattivare
+    NAVIDROME_RESCAN = os.getenv("NAVIDROME_RESCAN", "true") == "true"
+    NAVIDROME_SCAN_TIMEOUT = float(os.getenv("NAVIDROME_SCAN_TIMEOUT", "120"))
+    COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "cover_cache")
+    COVER_CACHE_MAX_MB = int(os.getenv("COVER_CACHE_MAX_MB", "200"))
+    COVER_MAX_AGE = int(os.getenv("COVER_MAX_AGE", "86400"))
+    COVER_EMBED_MAX_PX = int(os.getenv("COVER_EMBED_MAX_PX", "1200"))
+    COVER_EMBED_MAX_KB = int(os.getenv("COVER_EMBED_MAX_KB", "500"))
     
     # ===== SFTP Pikapod =====
     SFTP_HOST = os.getenv("SFTP_HOST")
     SFTP_PORT = os.getenv("SFTP_PORT")
     SFTP_USER = os.getenv("SFTP_USER")
     SFTP_PASS = os.getenv("SFTP_PASS")
+    SFTP_CONCURRENCY = int(os.getenv("SFTP_CONCURRENCY", "4"))
+    SFTP_IDLE_TIMEOUT = int(os.getenv("SFTP_IDLE_TIMEOUT", "300"))
+    SFTP_KEEPALIVE = int(os.getenv("SFTP_KEEPALIVE", "30"))
+    SFTP_RETRIES = int(os.getenv("SFTP_RETRIES", "3"))
+    SFTP_RETRY_DELAY = float(os.getenv("SFTP_RETRY_DELAY", "0.5"))  # raddoppia a ogni tentativo
+    SFTP_WINDOW_MB = int(os.getenv("SFTP_WINDOW_MB", "16"))
 
 
 settings = Settings()
@@ -1,28 +1,507 @@
-import paramiko
+import os
+import re
+import mmap
+import time
+import hashlib
+import threading
+import unicodedata
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from app.script.settings import settings
+from app.script.metrics import STAGE_BYTES, timed
+from app.script.fingerprints import fingerprints
 
-def upload_sftp(files: list, errors:list):
+# ------------------------
+# Pool connessioni SFTP
+# ------------------------
+class SFTPPool:
     """
-    files: lista di tuple (local_file, artist, title)
+    Canali SFTP riutilizzabili su un'unica connessione SSH persistente.
+    Il trasporto resta aperto (keep-alive) tra un upload e l'altro e viene
+    chiuso solo dopo idle_timeout secondi senza utilizzo.
+    paramiko (e cryptography) viene importato alla prima connessione,
+    non all'avvio dell'app.
     """
+
+    def __init__(self, size: int, idle_timeout: int, keepalive: int):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []  # [(sftp, ultimo utilizzo)]
+        self._transport = None
+        self._last_used = time.monotonic()
+        self._reaper = None
+
+    # Connessione
+    def _get_transport(self):
+        if self._transport is None or not self._transport.is_active():
+            self._close_transport()
+            import paramiko
+
+            # Finestra ampia: sul collegamento verso il pod il limite è la latenza, non la banda
+            transport = paramiko.Transport(
+                (settings.SFTP_HOST, int(settings.SFTP_PORT)),
+                default_window_size=settings.SFTP_WINDOW_MB * 1024 * 1024,
+            )
+            transport.set_keepalive(self.keepalive)
+            transport.connect(username=settings.SFTP_USER, password=settings.SFTP_PASS)
+            self._transport = transport
+            self._start_reaper()
+        return self._transport
+
+    def _close_transport(self):
+        for sftp, _ in self._idle:
+            sftp.close()
+        self._idle = []
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    @staticmethod
+    def _healthy(sftp) -> bool:
+        channel = sftp.get_channel()
+        return (
+            channel is not None
+            and not channel.closed
+            and channel.get_transport().is_active()
+        )
+
+    # Prestito canali
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                self._evict_idle()
+                while self._idle:
+                    sftp, _ = self._idle.pop()
+                    if self._healthy(sftp):
+                        self.in_use += 1
+                        return sftp
+                    sftp.close()
+
+                transport = self._get_transport()
+                import paramiko
+
+                sftp = paramiko.SFTPClient.from_transport(
+                    transport,
+                    window_size=settings.SFTP_WINDOW_MB * 1024 * 1024,
+                )
+                self.in_use += 1
+                return sftp
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, sftp):
+        with self._lock:
+            self.in_use -= 1
+            self._last_used = time.monotonic()
+            if self._healthy(sftp):
+                self._idle.append((sftp, self._last_used))
+            else:
+                sftp.close()
+        self._slots.release()
+
+    @contextmanager
+    def channel(self):
+        sftp = self.acquire()
+        try:
+            yield sftp
+        finally:
+            self.release(sftp)
+
+    # Pulizia canali inattivi
+    def _evict_idle(self):
+        now = time.monotonic()
+        keep = []
+        for sftp, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                sftp.close()
+            else:
+                keep.append((sftp, last_used))
+        self._idle = keep
+
+        if self.in_use == 0 and not self._idle and now - self._last_used > self.idle_timeout:
+            self._close_transport()
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle()
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+
+        def reap():
+            while True:
+                time.sleep(max(self.idle_timeout / 2, 1))
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, name="sftp-reaper", daemon=True)
+        self._reaper.start()
+
+    def close(self):
+        with self._lock:
+            self._close_transport()
+
+
+sftp_pool = SFTPPool(
+    size=settings.SFTP_CONCURRENCY,
+    idle_timeout=settings.SFTP_IDLE_TIMEOUT,
+    keepalive=settings.SFTP_KEEPALIVE,
+)
+
+_executor = ThreadPoolExecutor(max_workers=settings.SFTP_CONCURRENCY, thread_name_prefix="sftp")
+
+# ------------------------
+# Verifica contenuto
+# ------------------------
+# Un file remoto è identico a quello locale solo se lo sha256 coincide.
+# L'impronta del file remoto viene, nell'ordine:
+# - calcolata dal server con l'estensione check-file, se supportata
+#   (OpenSSH non la implementa);
+# - letta dall'indice locale (FINGERPRINT_FILE, tabella remote_files),
+#   dove viene salvata dopo ogni upload verificato o rilettura, valida
+#   finché dimensione e mtime remoti non cambiano;
+# - calcolata rileggendo tutto il file remoto.
+# Nessun file viene aggiunto alla libreria remota. Il file appena inviato
+# non ha ancora un'impronta affidabile: la sua verifica usa solo
+# check-file o la rilettura completa.
+CHUNK_SIZE = 256 * 1024
+SAMPLE_SIZE = 64 * 1024
+
+
+class VerifyError(IOError):
+    pass
+
+
+def _local_samples(local_file, ranges: list) -> list:
+    with open(local_file, "rb") as f:
+        out = []
+        for offset, length in ranges:
+            f.seek(offset)
+            out.append(f.read(length))
+        return out
+
+
+def _local_sha256(local_file) -> bytes:
+    digest = hashlib.sha256()
+    with open(local_file, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _remote_sha256(sftp, remote_path: str, size: int) -> bytes:
+    digest = hashlib.sha256()
+    with sftp.open(remote_path, "rb") as remote:
+        # Letture in pipeline: un solo round trip per l'intero file
+        remote.prefetch(size)
+        while chunk := remote.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _stored_digest(remote_path: str, attrs) -> bytes | None:
+    try:
+        return fingerprints.remote_digest(remote_path, attrs.st_size, attrs.st_mtime)
+    except Exception as e:
+        print(f"Impronta remota non leggibile per {remote_path}: {e}")
+        return None
+
+
+def _store_digest(sftp, remote_path: str, digest: bytes):
+    # Un errore qui costa solo una rilettura al prossimo confronto
+    try:
+        attrs = sftp.stat(remote_path)
+        fingerprints.record_remote(remote_path, digest, attrs.st_size, attrs.st_mtime)
+    except Exception as e:
+        print(f"Impronta remota non salvata per {remote_path}: {e}")
+
+
+def _same_content(sftp, remote_path: str, local_digest: bytes, size: int, stored: bool = True) -> bool:
+    """
+    True se il file remoto (già della stessa dimensione) ha lo sha256 local_digest
+    """
+    with sftp.open(remote_path, "rb") as remote:
+        try:
+            return remote.check("sha256") == local_digest
+        except IOError:
+            pass  # check-file non supportato dal server
+
+    if stored:
+        digest = _stored_digest(remote_path, sftp.stat(remote_path))
+        if digest is not None:
+            return digest == local_digest
+
+    digest = _remote_sha256(sftp, remote_path, size)
+    if stored:
+        _store_digest(sftp, remote_path, digest)
+    return digest == local_digest
+
+
+def _remote_size(sftp, path: str) -> int | None:
     try:
-        # Connessione al server SFTP
-        transport = paramiko.Transport((settings.SFTP_HOST, int(settings.SFTP_PORT)))
-        transport.connect(username=settings.SFTP_USER, password=settings.SFTP_PASS)
-        sftp = paramiko.SFTPClient.from_transport(transport)
+        return sftp.stat(path).st_size
+    except IOError:
+        return None
+
+# ------------------------
+# Upload
+# ------------------------
+def _resume_offset(sftp, part_path: str, local_file, size: int, offset: int | None) -> int:
+    """
+    Byte già presenti nel file .part, se la loro coda coincide con il file locale
+    """
+    if not offset or offset > size:
+        return 0
 
-        for local_file, artist, title in files:
-            remote_path = f"/music/{artist} - {title}.mp3"
-            try:
-                sftp.put(local_file, remote_path)
-            except Exception as e:
-                errors.append(f"Errore durante l'upload del file {local_file}: {str(e)}")
+    tail = (max(offset - SAMPLE_SIZE, 0), min(offset, SAMPLE_SIZE))
+    with sftp.open(part_path, "rb") as remote:
+        remote_tail = list(remote.readv([tail]))
+    if remote_tail != _local_samples(local_file, [tail]):
+        return 0
+    return offset
 
-        sftp.close()
-        transport.close()
 
+def _rename_free(sftp, part_path: str, remote_path: str) -> str:
+    """
+    rename SFTP, che non sostituisce file esistenti; se il nome è stato
+    occupato nel frattempo usa il primo nome libero. Ritorna il percorso finale.
+    """
+    try:
+        sftp.rename(part_path, remote_path)
+        return remote_path
+    except IOError:
+        if _remote_size(sftp, remote_path) is None:
+            raise
+    directory, name = remote_path.rsplit("/", 1)
+    free = f"{directory}/{_free_name(name, set(sftp.listdir(directory)))}"
+    sftp.rename(part_path, free)
+    return free
+
+
+def _transfer(sftp, local_file, local_digest: bytes, remote_path: str, callback=None, part_size=None, existing=None) -> str:
+    """
+    remote_path: nome libero scelto da plan_uploads.
+    existing: file remoto della stessa dimensione con il nome originale;
+    se identico (sha256) non viene inviato nulla.
+    part_size: dimensione del .part nota dal listing; se None (nuovo
+    tentativo) viene letta con stat.
+    Ritorna il percorso remoto finale.
+    """
+    size = os.path.getsize(local_file)
+    part_path = f"{remote_path}.part"
+
+    candidates = [existing] if existing else []
+    if part_size is None:
+        part_size = _remote_size(sftp, part_path)
+        # Il tentativo precedente può essere caduto dopo il rename
+        candidates.append(remote_path)
+
+    # Già presente e identico: niente da inviare
+    for path in candidates:
+        if _remote_size(sftp, path) == size and _same_content(sftp, path, local_digest, size):
+            if callback:
+                callback(size, size)
+            return path
+
+    # Invio su file temporaneo, riprendendo da un eventuale tentativo interrotto
+    offset = _resume_offset(sftp, part_path, local_file, size, part_size)
+
+    # File locale mappato in memoria e file remoto senza buffer: i blocchi
+    # arrivano a paramiko senza copie intermedie; le scritture sono in pipeline
+    with open(local_file, "rb") as src, sftp.open(part_path, "r+b" if offset else "wb", bufsize=0) as dst:
+        dst.set_pipelined(True)
+        dst.seek(offset)
+        sent = offset
+        if size > offset:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data, memoryview(data) as view:
+                while sent < size:
+                    # Ogni blocco va rilasciato prima di chiudere la mappa
+                    with view[sent:sent + CHUNK_SIZE] as chunk:
+                        dst.write(chunk)
+                        length = len(chunk)
+                    sent += length
+                    STAGE_BYTES.labels("out").inc(length)
+                    if callback:
+                        callback(sent, size)
+
+    if _remote_size(sftp, part_path) != size or not _same_content(sftp, part_path, local_digest, size, stored=False):
+        sftp.remove(part_path)
+        raise VerifyError("Verifica del file remoto fallita")
+
+    # Nome definitivo senza mai sostituire un file remoto esistente
+    remote_path = _rename_free(sftp, part_path, remote_path)
+    _store_digest(sftp, remote_path, local_digest)
+    return remote_path
+
+
+def _upload_one(item, progress=None) -> tuple:
+    """
+    Ritorna (percorso remoto finale, errore)
+    """
+    import paramiko
+
+    local_file, remote_path, part_size, existing = item
+
+    callback = None
+    if progress:
+        callback = lambda sent, total: progress(local_file, sent, total)
+
+    # Impronta locale calcolata una volta sola, valida per tutti i tentativi
+    try:
+        local_digest = _local_sha256(local_file)
+    except Exception as e:
+        return remote_path, f"Errore durante l'upload del file {local_file}: {str(e)}"
+
+    # Nuovi tentativi se la connessione cade (anche OSError/socket.error),
+    # con attesa esponenziale: l'invio riprende dal .part
+    for attempt in range(settings.SFTP_RETRIES):
+        if attempt:
+            time.sleep(settings.SFTP_RETRY_DELAY * 2 ** (attempt - 1))
+        try:
+            with sftp_pool.channel() as sftp, timed("sftp"):
+                # Dopo un errore le dimensioni del listing non valgono più
+                path = _transfer(sftp, local_file, local_digest, remote_path, callback, part_size if attempt == 0 else None, existing)
+            return path, None
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            if attempt < settings.SFTP_RETRIES - 1:
+                continue
+            return remote_path, f"Errore durante l'upload SFTP: {str(e)}"
+        except Exception as e:
+            return remote_path, f"Errore durante l'upload del file {local_file}: {str(e)}"
+
+# ------------------------
+# Percorsi remoti
+# ------------------------
+# I file vengono disposti come /music/Artista/Album/[disco-]traccia Titolo.mp3:
+# cartelle piccole per Navidrome e per i listing SFTP. Ogni cartella album
+# viene creata una volta e letta con un solo listdir prima dei trasferimenti.
+# Collisioni: qualsiasi nome già presente nella cartella (o già usato da un
+# altro file dello stesso upload) è occupato e il file riceve un suffisso
+# " (2)". Se il file esistente ha la stessa dimensione, il confronto sha256
+# (vedi _same_content) avviene in parallelo sui canali del pool, prima
+# dell'invio: se è identico l'invio viene saltato. Un file remoto non viene
+# mai sostituito.
+REMOTE_ROOT = "/music"
+NAME_MAX = 120
+_UNSAFE = re.compile(r'[\x00-\x1f<>:"/\\|?*]+')
+
+
+def sanitize(name: str, fallback: str) -> str:
+    """
+    Nome utilizzabile come singolo componente di percorso
+    """
+    name = _UNSAFE.sub("_", unicodedata.normalize("NFC", name or "")).strip(" .")
+    return name[:NAME_MAX].rstrip(" .") or fallback
+
+
+def album_dir(artist: str, album: str) -> str:
+    return f"{REMOTE_ROOT}/{sanitize(artist, 'Artista sconosciuto')}/{sanitize(album, 'Album sconosciuto')}"
+
+
+def track_filename(title: str, track_number=None, disc=None) -> str:
+    name = sanitize(title, "Senza titolo")
+    if track_number:
+        prefix = f"{int(track_number):02d}"
+        if disc:
+            prefix = f"{int(disc)}-{prefix}"
+        name = f"{prefix} {name}"
+    return f"{name}.mp3"
+
+
+def _makedirs(sftp, path: str):
+    # Risale fino alla prima cartella esistente, poi crea le mancanti
+    missing = []
+    current = path
+    while current:
+        try:
+            sftp.stat(current)
+            break
+        except IOError:
+            missing.append(current)
+            current = current.rsplit("/", 1)[0]
+    for directory in reversed(missing):
+        try:
+            sftp.mkdir(directory)
+        except IOError:
+            # Creata nel frattempo da un altro upload
+            sftp.stat(directory)
+
+
+def _free_name(name: str, taken) -> str:
+    stem = name[:-len(".mp3")]
+    n = 2
+    while name in taken:
+        name = f"{stem} ({n}).mp3"
+        n += 1
+    return name
+
+
+def plan_uploads(sftp, files: list) -> list:
+    """
+    files: dizionari con local_file, artist, album, title e opzionali track_number, disc.
+    Crea le cartelle degli album e ritorna (local_file, percorso remoto
+    libero, dimensione .part, file esistente da confrontare o None) per ogni file.
+    """
+    by_dir = {}
+    for item in files:
+        by_dir.setdefault(album_dir(item["artist"], item["album"]), []).append(item)
+
+    plan = []
+    for directory, items in by_dir.items():
+        _makedirs(sftp, directory)
+        listing = {entry.filename: entry.st_size for entry in sftp.listdir_attr(directory)}
+        taken = set()
+        for item in items:
+            name = track_filename(item["title"], item.get("track_number"), item.get("disc"))
+            size = os.path.getsize(item["local_file"])
+            existing = None
+            if name not in taken and listing.get(name) == size:
+                existing = f"{directory}/{name}"
+            if name in taken or name in listing:
+                name = _free_name(name, taken | set(listing))
+            taken.add(name)
+            plan.append((
+                item["local_file"],
+                f"{directory}/{name}",
+                listing.get(f"{name}.part"),
+                existing,
+            ))
+    return plan
+
+
+def upload_sftp(files: list, errors:list, progress=None, on_done=None):
+    """
+    files: dizionari come per plan_uploads.
+    I percorsi vengono pianificati su un solo canale, poi i file vengono
+    inviati in parallelo su canali del pool.
+    progress(local_file, inviati, totale) e on_done(local_file, percorso remoto, errore) sono opzionali.
+    """
+    try:
+        with sftp_pool.channel() as sftp:
+            plan = plan_uploads(sftp, files)
     except Exception as e:
-        errors.append(f"Errore durante l'upload SFTP: {str(e)}")
-        
+        error = f"Errore durante la preparazione delle cartelle remote: {str(e)}"
+        errors.append(error)
+        if on_done:
+            for item in files:
+                on_done(item["local_file"], None, error)
+        return errors
+
+    def run(item):
+        remote_path, error = _upload_one(item, progress)
+        if on_done:
+            on_done(item[0], remote_path, error)
+        return error
+
+    for error in _executor.map(run, plan):
+        if error:
+            errors.append(error)
+
     return errors
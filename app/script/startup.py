@@ -0,0 +1,151 @@
+import sys
+import time
+import asyncio
+import logging
+import builtins
+import importlib
+from pathlib import Path
+
+from app.script.settings import settings
+
+# Figlio di "uvicorn.error": stessi handler e livello (INFO) configurati da uvicorn
+logger = logging.getLogger("uvicorn.error").getChild("startup")
+
+# ------------------------
+# Costo degli import all'avvio
+# ------------------------
+# Con le macchine che si fermano quando sono inattive ogni prima richiesta
+# paga l'avvio dell'interprete e gli import di main.py. ImportProfiler
+# sostituisce __import__ finché l'app non è pronta e registra, per ogni
+# modulo caricato in quel momento, il tempo cumulativo (figli compresi).
+class ImportProfiler:
+
+    def __init__(self):
+        self.costs = {}  # modulo -> (secondi, importato direttamente da main.py)
+        self.started = time.perf_counter()
+        self.ready = None
+        self._original = None
+        self._depth = 0
+
+    def install(self):
+        if self._original is not None:
+            return
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Import relativi o già in cache: nessun costo da registrare
+        if level or name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+
+        top = self._depth == 0
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            self._depth -= 1
+            self.costs.setdefault(name, (time.perf_counter() - start, top))
+
+    def report(self, limit: int = 15) -> str:
+        """
+        Import diretti di main.py ordinati per costo, più i singoli moduli più lenti
+        """
+        total = (self.ready or time.perf_counter()) - self.started
+        direct = sorted(
+            ((name, cost) for name, (cost, top) in self.costs.items() if top),
+            key=lambda item: item[1], reverse=True,
+        )
+        slowest = sorted(
+            ((name, cost) for name, (cost, top) in self.costs.items() if not top),
+            key=lambda item: item[1], reverse=True,
+        )[:limit]
+
+        lines = [f"Avvio in {total * 1000:.0f} ms, import di main.py:"]
+        lines += [f"  {cost * 1000:8.1f} ms  {name}" for name, cost in direct if cost >= 0.001]
+        lines.append("Moduli più lenti (cumulativo):")
+        lines += [f"  {cost * 1000:8.1f} ms  {name}" for name, cost in slowest]
+        return "\n".join(lines)
+
+    def log(self):
+        logger.info("%s", self.report())
+
+
+import_profiler = ImportProfiler()
+
+# ------------------------
+# Warmup dopo l'avvio
+# ------------------------
+# paramiko/cryptography, Pillow e mutagen vengono importati da ssh_utils,
+# covers e metadata solo al primo utilizzo. Se STARTUP_WARMUP è attivo li
+# carica un task in background qualche secondo dopo l'avvio, così che la
+# prima richiesta (di solito /login) non li aspetti e il primo upload
+# nemmeno.
+WARMUP_MODULES = ["paramiko", "PIL.Image", "mutagen.mp3", "mutagen.id3"]
+
+
+class Warmup:
+
+    def __init__(self, modules: list, delay: float):
+        self.modules = modules
+        self.delay = delay
+        self.costs = {}
+        self._task = None
+
+    def _load(self):
+        for name in self.modules:
+            if name in sys.modules:
+                continue
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logger.warning("Warmup: %s non disponibile (%s)", name, e)
+                continue
+            self.costs[name] = time.perf_counter() - start
+
+    async def _run(self):
+        await asyncio.sleep(self.delay)
+        await asyncio.to_thread(self._load)
+        if self.costs and settings.STARTUP_REPORT:
+            loaded = ", ".join(f"{name} {cost * 1000:.0f} ms" for name, cost in self.costs.items())
+            logger.info("Warmup completato: %s", loaded)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+warmup = Warmup(WARMUP_MODULES, settings.STARTUP_WARMUP_DELAY)
+
+# ------------------------
+# Template precompilati
+# ------------------------
+def precompile_templates(env, cache_dir: str) -> int:
+    """
+    Compila tutti i template prima di servire richieste; il bytecode viene
+    salvato in cache_dir e riusato dagli altri worker e dai riavvii.
+    Ritorna il numero di template compilati.
+    """
+    from jinja2 import FileSystemBytecodeCache
+
+    path = Path(cache_dir).resolve()
+    path.mkdir(parents=True, exist_ok=True)
+    env.bytecode_cache = FileSystemBytecodeCache(str(path))
+
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
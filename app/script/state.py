@@ -0,0 +1,261 @@
+import json
+import time
+import sqlite3
+import threading
+
+from limits.storage import Storage
+
+from app.script.settings import settings
+
+# ------------------------
+# Stato condiviso tra worker
+# ------------------------
+# Chiave/valore con scadenza, visibile a tutti i processi uvicorn:
+# contatori del rate limit, job di upload, risposte Navidrome e
+# segnalazioni tra worker (catalogo da aggiornare, file temporanei in uso).
+# STATE_BACKEND=sqlite (default): file locale in modalità WAL.
+# STATE_BACKEND=redis: server Redis (o compatibile) su STATE_URL.
+class SQLiteState:
+
+    PURGE_EVERY = 500  # scritture tra una pulizia delle voci scadute e l'altra
+    BATCH_SIZE = 500   # chiavi per query in get_many (limite parametri SQLite)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una connessione per thread; autocommit, transazioni esplicite solo dove servono
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_entry(self, key: str):
+        """
+        (valore, scadenza) oppure None se assente o scaduto
+        """
+        row = self._conn().execute(
+            "SELECT value, expires FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get(self, key: str, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value, ttl: float | None = None):
+        expires = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Chiave -> valore per le sole chiavi presenti e non scadute
+        """
+        out = {}
+        conn = self._conn()
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            chunk = keys[start:start + self.BATCH_SIZE]
+            rows = conn.execute(
+                f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))}) "
+                "AND (expires IS NULL OR expires > ?)",
+                (*chunk, time.time()),
+            ).fetchall()
+            out.update((key, json.loads(value)) for key, value in rows)
+        return out
+
+    def set_many(self, values: dict, ttl: float | None = None):
+        expires = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), expires) for key, value in values.items()],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def delete_many(self, keys: list):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_prefix(self, prefix: str):
+        self._conn().execute("DELETE FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        """
+        Incremento atomico tra processi; la scadenza parte dal primo incremento
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                value, expires = amount, now + ttl
+            else:
+                value, expires = json.loads(row[0]) + amount, row[1]
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def expiry(self, key: str) -> float:
+        entry = self.get_entry(key)
+        return entry[1] if entry and entry[1] else time.time()
+
+    def purge(self):
+        self._conn().execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+
+
+class RedisState:
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get_entry(self, key: str):
+        pipe = self.client.pipeline()
+        pipe.get(key)
+        pipe.pttl(key)
+        raw, pttl = pipe.execute()
+        if raw is None:
+            return None
+        return json.loads(raw), (time.time() + pttl / 1000 if pttl > 0 else None)
+
+    def get(self, key: str, default=None):
+        raw = self.client.get(key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key: str, value, ttl: float | None = None):
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def get_many(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        return {key: json.loads(raw) for key, raw in zip(keys, self.client.mget(keys)) if raw is not None}
+
+    def set_many(self, values: dict, ttl: float | None = None):
+        pipe = self.client.pipeline()
+        for key, value in values.items():
+            pipe.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+        pipe.execute()
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def delete_many(self, keys: list):
+        if keys:
+            self.client.delete(*keys)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self.client.scan_iter(match=f"{prefix}*", count=500))
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        pipe = self.client.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, int(ttl), nx=True)
+        return pipe.execute()[0]
+
+    def expiry(self, key: str) -> float:
+        pttl = self.client.pttl(key)
+        return time.time() + max(pttl, 0) / 1000
+
+    def purge(self):
+        pass  # scadenze gestite da Redis
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                if settings.STATE_BACKEND == "redis":
+                    _state = RedisState(settings.STATE_URL)
+                else:
+                    _state = SQLiteState(settings.STATE_FILE)
+    return _state
+
+# ------------------------
+# Storage per slowapi (limits)
+# ------------------------
+class SharedLimitsStorage(Storage):
+    """
+    Contatori del rate limit (finestra fissa) sul backend SQLite condiviso
+    """
+
+    STORAGE_SCHEME = ["coemify"]
+
+    def __init__(self, uri: str = "coemify://", wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        return get_state().incr(f"limit:{key}", expiry, amount)
+
+    def get(self, key: str) -> int:
+        return get_state().get(f"limit:{key}", 0)
+
+    def get_expiry(self, key: str) -> float:
+        return get_state().expiry(f"limit:{key}")
+
+    def check(self) -> bool:
+        try:
+            get_state().get("limit:check")
+            return True
+        except Exception:
+            return False
+
+    def reset(self):
+        get_state().delete_prefix("limit:")
+
+    def clear(self, key: str):
+        get_state().delete(f"limit:{key}")
+
+
+def limiter_storage_uri() -> str:
+    # Con Redis il rate limit usa direttamente lo storage redis di limits
+    return settings.STATE_URL if settings.STATE_BACKEND == "redis" else "coemify://"
@@ -0,0 +1,60 @@
+import re
+import bisect
+import unicodedata
+
+# ------------------------
+# Indice per l'autocompletamento
+# ------------------------
+# Array ordinato di chiavi normalizzate (senza accenti, casefold): per ogni
+# voce il nome intero e ogni parola da cui inizia il resto del nome, così
+# "beat" trova anche "The Beatles". La ricerca è una bisect sul prefisso;
+# i risultati sul nome intero precedono quelli a metà nome.
+_NON_ALNUM = re.compile(r"[^\w]+")
+
+
+def fold(text: str) -> str:
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_NON_ALNUM.sub(" ", text.casefold()).split())
+
+
+class SuggestIndex:
+
+    def __init__(self, entries: list):
+        """
+        entries: dizionari con almeno "name"; vengono restituiti così come sono
+        """
+        self.entries = entries
+        keys = []
+        for position, entry in enumerate(entries):
+            words = fold(entry["name"]).split()
+            for start in range(len(words)):
+                # (chiave, posizione della parola, indice voce)
+                keys.append((" ".join(words[start:]), start, position))
+        keys.sort()
+        self._keys = keys
+        self._strings = [key for key, _, _ in keys]
+
+    def search(self, query: str, limit: int = 10) -> list:
+        prefix = fold(query)
+        if not prefix:
+            return []
+
+        # Tutte le chiavi con il prefisso cercato sono contigue
+        matches = {}
+        i = bisect.bisect_left(self._strings, prefix)
+        while i < len(self._keys) and self._strings[i].startswith(prefix):
+            key, start, position = self._keys[i]
+            # Una voce compare una volta sola, con la corrispondenza migliore
+            rank = (start > 0, len(self.entries[position]["name"]), key)
+            if position not in matches or rank < matches[position]:
+                matches[position] = rank
+            i += 1
+
+        best = sorted(matches, key=matches.get)[:limit]
+        return [self.entries[position] for position in best]
+
+    def __len__(self):
+        return len(self.entries)
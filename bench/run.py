@@ -0,0 +1,287 @@
+"""
+Benchmark di upload-temp, upload-final e degli endpoint del catalogo.
+
+Uso (dalla root del repository):
+    python -m bench.run --tracks 12 --track-kb 8192 --cover-px 1500 --rounds 5
+    python -m bench.run --compare bench/results/<commit>.json
+
+L'app gira nello stesso processo (TestClient), Navidrome e SFTP sono server
+finti in processi separati. I risultati vengono salvati in bench/results/
+con il commit corrente nel nome.
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from multiprocessing import Process
+
+from bench.stubs import free_port, serve_navidrome, serve_sftp
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "bench" / "results"
+
+# Valori usati solo se non già presenti nell'ambiente
+DEFAULT_ENV = {
+    "APP_NAME": "Coemify",
+    "SECRET_KEY": "bench",
+    "SESSION_COOKIE_NAME": "coemify_session",
+    "SESSION_MAX_AGE": "3600",
+    "SESSION_SAMESITE": "lax",
+    "APP_USER": "bench",
+    "APP_PASS": "bench",
+    "MAX_UPLOAD_SIZE_MB": "200",
+    "ALLOWED_MIME_PREFIX": "audio",
+    "PORT": "8080",
+    "WORKERS": "1",
+    "LOGIN_RATE_LIMIT": "1000/minute",
+    "UPLOAD_RATE_LIMIT": "1000/minute",
+}
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summary(latencies: list, total_bytes: int = 0) -> dict:
+    elapsed = sum(latencies)
+    result = {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(elapsed / len(latencies) * 1000, 2),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+    if total_bytes:
+        result["mb_s"] = round(total_bytes / elapsed / 1024 / 1024, 2)
+    return result
+
+
+def commit_id() -> str:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "app", "main.py"], cwd=ROOT)
+        return f"{sha}-dirty" if dirty else sha
+    except Exception:
+        return "unknown"
+
+
+def wait_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Porta {port} non raggiungibile")
+
+
+def start_stubs(work: Path, args) -> tuple[list, dict]:
+    nav_port, sftp_port = free_port(), free_port()
+    (work / "sftp" / "music").mkdir(parents=True)
+    procs = [
+        Process(target=serve_navidrome, args=(nav_port, args.catalog_albums, args.navidrome_latency), daemon=True),
+        Process(target=serve_sftp, args=(sftp_port, str(work / "sftp")), daemon=True),
+    ]
+    for p in procs:
+        p.start()
+    wait_port(nav_port)
+    wait_port(sftp_port)
+
+    env = {
+        "NAVIDROME_URL": f"http://127.0.0.1:{nav_port}",
+        "NAVIDROME_USER": "bench",
+        "NAVIDROME_PASS": "bench",
+        "SFTP_HOST": "127.0.0.1",
+        "SFTP_PORT": str(sftp_port),
+        "SFTP_USER": "bench",
+        "SFTP_PASS": "bench",
+        "UPLOAD_DIR": str(work / "upload"),
+        "COVER_CACHE_DIR": str(work / "covers"),
+        "TEMPLATE_CACHE_DIR": str(work / "templates"),
+        "STATE_BACKEND": "sqlite",
+        "STATE_FILE": str(work / "state.db"),
+        "FINGERPRINT_FILE": str(work / "fingerprints.db"),
+        "CATALOG_FILE": str(work / "catalog.json"),
+        # Host usato da TestClient, accettato da TrustedHostMiddleware
+        "HOST": "testserver",
+    }
+    return procs, env
+
+# ------------------------
+# Scenari
+# ------------------------
+def bench_upload_temp(client, album: list) -> tuple[float, dict]:
+    files = [("files", (p.name, open(p, "rb"), "audio/mpeg")) for p in album]
+    try:
+        start = time.perf_counter()
+        r = client.post("/api/upload-temp", files=files)
+        elapsed = time.perf_counter() - start
+    finally:
+        for _, (_, f, _) in files:
+            f.close()
+    r.raise_for_status()
+    data = r.json()
+    if data["errors"]:
+        raise RuntimeError(f"upload-temp: {data['errors']}")
+    return elapsed, data
+
+
+def bench_upload_final(client, temp: dict, round_id: int) -> float:
+    tracks = [
+        {"temp_file": t["temp_file"], "title": f"{t['title']} #{round_id}", "track_number": t["track_number"]}
+        for t in temp["tracks"]
+    ]
+    form = {
+        "artist": "Bench Artist",
+        "album": f"Bench Album #{round_id}",
+        "genre": "Rock",
+        "release_date": "2024",
+        "tracks": json.dumps(tracks),
+    }
+    if temp["album"]["cover"]:
+        form["cover_id"] = temp["album"]["cover"].rsplit("/", 1)[-1]
+
+    start = time.perf_counter()
+    r = client.post("/api/upload-final", data=form)
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    while True:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - start
+    if job["status"] == "failed" or job["errors"]:
+        raise RuntimeError(f"upload-final: {job['errors']}")
+    return elapsed
+
+
+CATALOG_ENDPOINTS = [
+    ("GET", "/api/artists", None),
+    ("GET", "/api/albums", None),
+    ("GET", "/api/genres", None),
+    ("GET", "/api/albums/artist/ar1", None),
+    ("POST", "/api/check-duplicates", {"artist": "Artist 0001", "titles": [f"Song {i}" for i in range(20)]}),
+]
+
+
+def bench_catalog(client, requests: int) -> dict:
+    results = {}
+
+    # Primo accesso: sincronizzazione completa del catalogo
+    start = time.perf_counter()
+    client.get("/api/artists").raise_for_status()
+    results["catalog_cold"] = summary([time.perf_counter() - start])
+
+    for method, path, body in CATALOG_ENDPOINTS:
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            r = client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            r.raise_for_status()
+        results[f"{method} {path}"] = summary(latencies)
+    return results
+
+# ------------------------
+# Confronto
+# ------------------------
+def compare(current: dict, previous: dict):
+    print(f"\nConfronto con {previous['commit']}:")
+    for name, stats in current["scenarios"].items():
+        old = previous["scenarios"].get(name)
+        if not old:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p99_ms", "mb_s"):
+            if key in stats and old.get(key):
+                deltas.append(f"{key} {old[key]} -> {stats[key]} ({(stats[key] - old[key]) / old[key] * 100:+.1f}%)")
+        print(f"  {name}: " + ", ".join(deltas))
+    old_rss = previous.get("peak_rss_mb")
+    if old_rss:
+        print(f"  peak_rss_mb: {old_rss} -> {current['peak_rss_mb']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Coemify")
+    parser.add_argument("--tracks", type=int, default=12)
+    parser.add_argument("--track-kb", type=int, default=8192)
+    parser.add_argument("--cover-px", type=int, default=1500, help="0 per tracce senza copertina")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--catalog-albums", type=int, default=2000)
+    parser.add_argument("--catalog-requests", type=int, default=50)
+    parser.add_argument("--navidrome-latency", type=float, default=0.0, help="ritardo (s) di ogni risposta Navidrome")
+    parser.add_argument("--compare", type=Path, help="risultato precedente da confrontare")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="coemify-bench-"))
+    procs, env = start_stubs(work, args)
+
+    # Le impostazioni vengono lette all'import di main
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ.update(env)
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+
+    import main as app_main
+    from fastapi.testclient import TestClient
+    from app.script.settings import settings
+    from bench.synth import make_album
+
+    album = make_album(work / "album", args.tracks, args.track_kb, args.cover_px)
+    album_bytes = sum(p.stat().st_size for p in album)
+
+    scenarios = {}
+    temp_latencies, final_latencies = [], []
+    try:
+        with TestClient(app_main.app) as client:
+            client.cookies.set(settings.SESSION_COOKIE_NAME, "logged_in")
+
+            for round_id in range(args.rounds):
+                elapsed, temp = bench_upload_temp(client, album)
+                temp_latencies.append(elapsed)
+                final_latencies.append(bench_upload_final(client, temp, round_id))
+
+            scenarios["upload-temp"] = summary(temp_latencies, album_bytes * args.rounds)
+            scenarios["upload-final"] = summary(final_latencies, album_bytes * args.rounds)
+            scenarios.update(bench_catalog(client, args.catalog_requests))
+    finally:
+        for p in procs:
+            p.terminate()
+
+    result = {
+        "commit": commit_id(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "album_mb": round(album_bytes / 1024 / 1024, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "scenarios": scenarios,
+    }
+
+    for name, stats in scenarios.items():
+        print(f"{name:40} " + "  ".join(f"{k}={v}" for k, v in stats.items()))
+    print(f"{'peak_rss_mb':40} {result['peak_rss_mb']}")
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        out = RESULTS_DIR / f"{result['commit']}.json"
+        out.write_text(json.dumps(result, indent=2))
+        print(f"\nRisultati salvati in {out}")
+
+    if args.compare:
+        compare(result, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
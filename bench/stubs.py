@@ -0,0 +1,218 @@
+import os
+import json
+import logging
+import time
+import socket
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# ------------------------
+# Server finti per il benchmark
+# ------------------------
+# Eseguiti in processi separati (multiprocessing) così che la RSS misurata
+# sia solo quella dell'app.
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Navidrome (API Subsonic in JSON)
+def _catalog(albums: int):
+    artists = [{"id": f"ar{i}", "name": f"Artist {i:04d}"} for i in range(max(albums // 10, 1))]
+    album_list = [
+        {
+            "id": f"al{i}",
+            "name": f"Album {i:05d}",
+            "artist": artists[i % len(artists)]["name"],
+            "artistId": artists[i % len(artists)]["id"],
+            "coverArt": f"al-{i}",
+            "year": 2000 + i % 25,
+            "genre": "Rock",
+        }
+        for i in range(albums)
+    ]
+    songs = [
+        {"id": f"s{i}", "title": f"Song {i}", "artist": album_list[i // 10]["artist"], "albumId": album_list[i // 10]["id"]}
+        for i in range(albums * 10)
+    ]
+    return artists, album_list, songs
+
+
+def _ok(**data):
+    return {"subsonic-response": {"status": "ok", "version": "1.16.1", **data}}
+
+
+def serve_navidrome(port: int, albums: int, latency: float):
+    artists, album_list, songs = _catalog(albums)
+    scans = []
+    by_artist = {}
+    for a in album_list:
+        by_artist.setdefault(a["artistId"], []).append(a)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            scope = url.path.rsplit("/", 1)[-1]
+            if latency:
+                time.sleep(latency)
+
+            if scope == "getCoverArt":
+                return self._send(b"\xff\xd8\xff\xe0" + os.urandom(int(q.get("size", 250)) * 40), "image/jpeg")
+
+            if scope == "getArtists":
+                data = _ok(artists={"index": [{"name": "A", "artist": artists}]})
+            elif scope == "getIndexes":
+                data = _ok(indexes={"lastModified": 1, "index": []})
+            elif scope == "getAlbumList2":
+                size, offset = int(q.get("size", 10)), int(q.get("offset", 0))
+                ordered = album_list if q.get("type") != "newest" else album_list[::-1]
+                data = _ok(albumList2={"album": ordered[offset:offset + size]})
+            elif scope == "getAlbum":
+                album = next(a for a in album_list if a["id"] == q["id"])
+                data = _ok(album={**album, "song": [s for s in songs if s["albumId"] == q["id"]]})
+            elif scope == "getArtist":
+                data = _ok(artist={"id": q["id"], "album": by_artist.get(q["id"], [])})
+            elif scope == "getGenres":
+                data = _ok(genres={"genre": [{"value": "Rock"}, {"value": "Jazz"}]})
+            elif scope == "search3":
+                count, offset = int(q.get("songCount", 20)), int(q.get("songOffset", 0))
+                data = _ok(searchResult3={"song": songs[offset:offset + count]})
+            elif scope == "startScan":
+                scans.append(time.time())
+                data = _ok(scanStatus={"scanning": True, "count": len(songs), "lastScan": None})
+            elif scope == "getScanStatus":
+                data = _ok(scanStatus={"scanning": False, "count": len(songs), "lastScan": scans[-1] if scans else None})
+            else:
+                data = {"subsonic-response": {"status": "failed", "error": {"code": 0, "message": scope}}}
+            self._send(json.dumps(data).encode())
+
+        def _send(self, body: bytes, content_type: str = "application/json"):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+# SFTP su cartella locale
+def serve_sftp(port: int, root: str):
+    import paramiko
+    from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK
+
+    class Server(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    class Handle(SFTPHandle):
+        def stat(self):
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+        def chattr(self, attr):
+            return SFTP_OK
+
+    def errno(e):
+        return SFTPServer.convert_errno(e.errno)
+
+    class Interface(SFTPServerInterface):
+        def _path(self, path):
+            return root + self.canonicalize(path)
+
+        def canonicalize(self, path):
+            return os.path.normpath("/" + path)
+
+        def list_folder(self, path):
+            out = []
+            for name in os.listdir(self._path(path)):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(self._path(path), name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+
+        def stat(self, path):
+            try:
+                return SFTPAttributes.from_stat(os.stat(self._path(path)))
+            except OSError as e:
+                return errno(e)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(self._path(path), flags, 0o644)
+            except OSError as e:
+                return errno(e)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = Handle(flags)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            try:
+                os.remove(self._path(path))
+            except OSError as e:
+                return errno(e)
+            return SFTP_OK
+
+        def rename(self, old, new):
+            # Come OpenSSH: rename non sostituisce un file esistente
+            try:
+                os.link(self._path(old), self._path(new))
+                os.remove(self._path(old))
+            except OSError as e:
+                return errno(e)
+            return SFTP_OK
+
+        def posix_rename(self, old, new):
+            try:
+                os.replace(self._path(old), self._path(new))
+            except OSError as e:
+                return errno(e)
+            return SFTP_OK
+
+        def mkdir(self, path, attr):
+            try:
+                os.mkdir(self._path(path))
+            except OSError as e:
+                return errno(e)
+            return SFTP_OK
+
+        def chattr(self, path, attr):
+            return SFTP_OK
+
+    # Solo errori gravi: le connessioni di prova chiuse subito non sono un problema
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", port))
+    sock.listen(16)
+    while True:
+        conn, _ = sock.accept()
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(key)
+        transport.set_subsystem_handler("sftp", SFTPServer, Interface)
+        try:
+            transport.start_server(server=Server())
+        except (paramiko.SSHException, EOFError):
+            # Es. la sonda di wait_port, che chiude senza handshake
+            transport.close()
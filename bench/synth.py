@@ -0,0 +1,61 @@
+import io
+import os
+from pathlib import Path
+
+from app.script import id3
+
+# ------------------------
+# Album MP3 sintetici
+# ------------------------
+# Frame MPEG1 Layer III, 128 kbps, 44.1 kHz: 417 byte l'uno (~26 ms di audio).
+# Il contenuto audio è rumore casuale, ma header e durata sono validi per
+# i parser (id3.audio_length e mutagen).
+FRAME_HEADER = b"\xff\xfb\x90\x00"
+FRAME_SIZE = 417
+
+
+def make_cover(px: int) -> bytes:
+    """
+    JPEG di px x px pixel; con rumore per avere una dimensione realistica
+    """
+    from PIL import Image
+
+    image = Image.effect_noise((px, px), 64).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def make_track(path: Path, size_kb: int, title: str, artist: str, album: str, number: int, cover: bytes | None):
+    frames = [
+        id3.text_frame("TIT2", title),
+        id3.text_frame("TPE1", artist),
+        id3.text_frame("TALB", album),
+        id3.text_frame("TRCK", str(number)),
+        id3.text_frame("TCON", "Rock"),
+        id3.text_frame("TDRC", "2024"),
+    ]
+    if cover:
+        frames.append(id3.apic_frame("image/jpeg", cover))
+    body = b"".join(frames)
+    header = b"ID3\x04\x00\x00" + id3._to_syncsafe(len(body))
+
+    count = max(size_kb * 1024 // FRAME_SIZE, 1)
+    # Blocco di frame riutilizzato: basta che i byte audio non siano tutti uguali
+    block = b"".join(FRAME_HEADER + os.urandom(FRAME_SIZE - 4) for _ in range(64))
+    with open(path, "wb") as f:
+        f.write(header + body)
+        for _ in range(count // 64):
+            f.write(block)
+        f.write(block[:(count % 64) * FRAME_SIZE])
+
+
+def make_album(directory: Path, tracks: int, track_kb: int, cover_px: int, name: str = "Bench") -> list:
+    directory.mkdir(parents=True, exist_ok=True)
+    cover = make_cover(cover_px) if cover_px else None
+    paths = []
+    for n in range(1, tracks + 1):
+        path = directory / f"{n:02d} - {name} Track {n}.mp3"
+        make_track(path, track_kb, f"{name} Track {n}", f"{name} Artist", f"{name} Album", n, cover)
+        paths.append(path)
+    return paths
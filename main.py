@@ -1,19 +1,27 @@
 # main.py
 
+# Profilo degli import all'avvio: va installato prima di tutti gli altri
+from app.script.startup import import_profiler, warmup, precompile_templates
+import_profiler.install()
+
 # Default
 import os
 from pathlib import Path
 import uuid
-import time
+import re
 import json
+import gzip
+import time
+import asyncio
+import secrets
 from typing import List
 
 # FastAPI
-from fastapi import FastAPI, Response, Request, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, Response, Request, File, UploadFile, HTTPException, Form, Body
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import PlainTextResponse, JSONResponse, RedirectResponse
+from fastapi.responses import PlainTextResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.concurrency import run_in_threadpool
@@ -25,9 +33,17 @@ from slowapi.errors import RateLimitExceeded
 
 # Utils
 from app.script.settings import settings
-from app.script.ssh_utils import upload_sftp
-from app.script.metadata import extract_metadata, update_metadata
-from app.script.apis import check_duplicates_navidrome, get_navidrome_artist, get_navidrome_albums, get_albums_by_artist, get_navidrome_image, get_navidrome_genres
+from app.script.state import limiter_storage_uri
+from app.script.ssh_utils import upload_sftp, sftp_pool
+from app.script.metadata import extract_metadata, update_metadata, prepare_cover, parse_track_number
+from app.script.ingest import save_upload, extract_archive, is_archive, group_albums, run_in_ingest_pool, shutdown_ingest_pool
+from app.script.covers import cover_cache, cover_response, detect_image_mime
+from app.script.janitor import temp_janitor
+from app.script.fingerprints import fingerprints, audio_digest
+from app.script.metrics import MetricsMiddleware, STAGE_BYTES, metrics_response, observe_stage, timed
+from app.script.jobs import create_job, get_job, submit_job, start_worker, stop_worker
+from app.script.apis import get_albums_by_artist, get_navidrome_image, get_navidrome_genres, invalidate_navidrome_cache, rescan_navidrome, close_client
+from app.script.catalog import catalog, suggest, get_navidrome_artist, get_navidrome_albums, check_duplicates_navidrome, check_duplicates_batch
 
 # ------------------------------
 # FastAPI + Middleware
@@ -54,7 +70,7 @@ if hasattr(settings, "HOST"):
 # Middleware per protezione dashboard
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request, call_next):
-        protected_paths = ["/dashboard", "/search-duplicates", "/upload-temp", "/upload-final", "/api/upload-temp-batch", "/api/upload-final-batch"]
+        protected_paths = ["/dashboard", "/search-duplicates", "/upload-temp", "/upload-final", "/api/upload-temp-batch", "/api/upload-temp/stream", "/api/upload-final-batch", "/api/upload-bulk", "/api/jobs"]
         if any(request.url.path.startswith(p) for p in protected_paths):
             cookie = request.cookies.get(settings.SESSION_COOKIE_NAME)
             if cookie != "logged_in":
@@ -64,10 +80,14 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
 app.add_middleware(AuthMiddleware)
 
+# Latenza per route (più esterno: misura anche l'autenticazione)
+app.add_middleware(MetricsMiddleware)
+
 # ------------------------------
 # Rate Limiting
 # ------------------------------
-limiter = Limiter(key_func=get_remote_address)
+# Contatori nello stato condiviso: il limite vale per tutti i worker insieme
+limiter = Limiter(key_func=get_remote_address, storage_uri=limiter_storage_uri())
 app.state.limiter = limiter
 
 @app.exception_handler(RateLimitExceeded)
@@ -78,6 +98,8 @@ async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
 # Templates e static
 # ------------------------------
 templates = Jinja2Templates(directory="app/templates")
+# Compilati ora e non alla prima richiesta di /login
+precompile_templates(templates.env, settings.TEMPLATE_CACHE_DIR)
 app_dir = os.path.dirname(__file__)
 static_dir = os.path.join(app_dir, "static")
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
@@ -87,6 +109,47 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 # ------------------------------
 UPLOAD_DIR = Path(settings.UPLOAD_DIR).resolve()
 MAX_SIZE = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+CHUNK_SIZE = settings.UPLOAD_CHUNK_SIZE_KB * 1024
+COVER_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Numero massimo di file elaborati in parallelo per batch
+ingest_limit = asyncio.Semaphore(settings.INGEST_CONCURRENCY)
+
+@app.on_event("startup")
+async def startup_workers():
+    start_worker()
+    temp_janitor.start()
+
+    # Fine del profilo import; i moduli pesanti arrivano col warmup o al primo utilizzo
+    import_profiler.ready = time.perf_counter()
+    import_profiler.uninstall()
+    if settings.STARTUP_REPORT:
+        import_profiler.log()
+    if settings.STARTUP_WARMUP:
+        warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    await warmup.stop()
+    await stop_worker()
+    await temp_janitor.stop()
+    shutdown_ingest_pool()
+    sftp_pool.close()
+    await catalog.stop()
+    await close_client()
+
+# ------------------------------
+# Metriche
+# ------------------------------
+# Accesso con la sessione dell'app oppure "Authorization: Bearer METRICS_TOKEN"
+@app.get("/metrics")
+def metrics(request: Request):
+    logged_in = request.cookies.get(settings.SESSION_COOKIE_NAME) == "logged_in"
+    token = settings.METRICS_TOKEN
+    bearer = request.headers.get("authorization", "")
+    if not logged_in and not (token and secrets.compare_digest(bearer.encode(), f"Bearer {token}".encode())):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    return metrics_response()
 
 # ------------------------------
 # Login endpoints
@@ -135,57 +198,222 @@ def dashboard(request: Request):
 @app.get("/api/search-duplicates")
 async def search_duplicates(artist: str):
     """Ricerca duplicati per titolo e artista"""
-    duplicates = check_duplicates_navidrome(artist)
+    duplicates = await check_duplicates_navidrome(artist)
     return duplicates
 
+# Controllo duplicati per tutte le tracce di un upload
+@app.post("/api/check-duplicates")
+async def check_duplicates(payload: dict = Body(...)):
+    """
+    Body: {"artist": "...", "titles": ["...", ...]}
+    Ritorna un booleano per titolo, nello stesso ordine
+    """
+    artist = payload.get("artist") or ""
+    titles = payload.get("titles") or []
+    if not isinstance(titles, list):
+        raise HTTPException(400, "Formato titoli non valido")
+    return {"duplicates": await check_duplicates_batch(artist, [str(t) for t in titles])}
+
+# Liste complete compresse se il client lo accetta
+async def list_response(request: Request, data) -> Response:
+    body = json.dumps(data, ensure_ascii=False).encode()
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) > 1024 and "gzip" in request.headers.get("accept-encoding", ""):
+        body = await run_in_threadpool(gzip.compress, body, 6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+# Autocompletamento
+@app.get("/api/suggest")
+async def suggest_names(kind: str, q: str, limit: int = 10):
+    """Primi risultati per prefisso tra artisti, album o generi del catalogo"""
+    if kind not in ("artist", "album", "genre"):
+        raise HTTPException(400, "Tipo non valido")
+    return await suggest(kind, q, max(1, min(limit, 50)))
+
 # Artisti
 @app.get("/api/artists")
-async def get_all_artists():
+async def get_all_artists(request: Request):
     """Ottiene tutti gli artisti caricati su Navidrome"""
-    artists = get_navidrome_artist()
-    return artists
+    artists = await get_navidrome_artist()
+    return await list_response(request, artists)
 
 # Albums
 @app.get("/api/albums")
-async def get_albums():
+async def get_albums(request: Request):
     """Ottiene gli album per un artista specifico"""
-    albums = get_navidrome_albums()
-    return albums
+    albums = await get_navidrome_albums()
+    return await list_response(request, albums)
 
 # Generi
 @app.get("/api/genres")
-async def get_albums():
+async def get_albums(request: Request):
     """Ottiene tutti i generi"""
-    albums = get_navidrome_genres()
-    return albums
+    albums = await get_navidrome_genres()
+    return await list_response(request, albums)
 
 # Meta albums per autocompilazione
 @app.get("/api/albums/artist/{artist_id}")
 async def get_albums(artist_id: str):
     """Ottiene gli album per un artista specifico"""
-    albums = get_albums_by_artist(artist_id)
-    print(albums)
+    albums = await get_albums_by_artist(artist_id)
     return albums
 
 # Immagine cover album
 @app.get("/api/albums/cover/{cover_id}")
-def navidrome_cover(cover_id: str, size: int = 250):
-    r = get_navidrome_image(cover_id, size)
-    return Response(
-        content=r.content,
-        media_type=r.headers.get("Content-Type", "image/jpeg")
-    )
+async def navidrome_cover(request: Request, cover_id: str, size: int = 250):
+    """Copertina da Navidrome, servita dalla cache su disco"""
+    if not 0 < size <= 2000:
+        raise HTTPException(400, "Dimensione non valida")
+
+    try:
+        cached = await cover_cache.get(cover_id, size, lambda: get_navidrome_image(cover_id, size))
+    except Exception as e:
+        print(f"Errore copertina {cover_id}: {e}")
+        cached = None
+
+    if cached is None:
+        return RedirectResponse(url="/static/img/default-small.jpg")
+
+    return cover_response(request, *cached)
+
+
+# Copertine estratte dai file caricati
+@app.get("/api/covers/{digest}")
+async def upload_cover(request: Request, digest: str):
+    """Copertina per hash di contenuto (da /api/upload-temp)"""
+    cached = await run_in_threadpool(cover_cache.upload, digest) if COVER_DIGEST.fullmatch(digest) else None
+    if cached is None:
+        raise HTTPException(404, "Copertina non trovata")
+    return cover_response(request, *cached)
 
 
 # ------------------------------
 # Batch Upload (Multi-file Album)
 # ------------------------------
+async def save_file(file: UploadFile, batch: str):
+    """
+    Valida e salva un singolo file in UPLOAD_DIR e lo registra nel batch.
+    Il file è già stato ricevuto per intero da Starlette: header MP3 e
+    dimensione massima vengono controllati durante la copia in UPLOAD_DIR.
+    Ritorna (nome salvato, errore).
+    """
+    try:
+        # Check MIME type (solo MP3)
+        if file.content_type != "audio/mpeg":
+            return None, file.filename + ": tipologia di file non valida"
+
+        # Check estensione (solo .mp3)
+        ext = Path(file.filename).suffix.lower()
+        if ext != ".mp3":
+            return None, file.filename + ": estensione non valida"
+
+        filename = f"{uuid.uuid4()}_{Path(file.filename).name}"
+        temp_path = UPLOAD_DIR / filename
+
+        # Copia a blocchi: in memoria resta al massimo un blocco per file
+        try:
+            with timed("save"):
+                size = await run_in_threadpool(save_upload, file.file, temp_path, MAX_SIZE, CHUNK_SIZE)
+        except ValueError as e:
+            return None, file.filename + ": " + str(e)
+        except Exception as e:
+            return None, file.filename + ": errore durante il salvataggio - " + str(e)
+
+        if not temp_path.is_file():
+            return None, file.filename + ": file non salvato correttamente"
+
+        temp_janitor.register(batch, filename, size)
+        STAGE_BYTES.labels("in").inc(size)
+        return filename, None
+
+    except Exception as e:
+        return None, file.filename + ": errore sconosciuto - " + str(e)
+
+
+async def ingest_file(file: UploadFile, batch: str, include_cover: bool = False):
+    """
+    Salva un singolo file, lo registra nel batch ed estrae i metadati.
+    Ritorna (metadata, track, errore); la concorrenza è limitata da ingest_limit.
+    """
+    async with ingest_limit:
+        filename, error = await save_file(file, batch)
+        if error:
+            return None, None, error
+        try:
+            metadata, track = await extract_track(filename, file.filename, include_cover)
+            return metadata, track, None
+        except Exception as e:
+            return None, None, file.filename + ": errore sconosciuto - " + str(e)
+
+
+async def extract_track(filename: str, original_filename: str, include_cover: bool = False):
+    """
+    Metadati di un file già salvato in UPLOAD_DIR e relativa traccia
+    """
+    # Parsing e impronta audio fuori dall'event loop
+    path = str(UPLOAD_DIR / filename)
+    with timed("extract"):
+        metadata, fingerprint = await asyncio.gather(
+            run_in_ingest_pool(extract_metadata, path, include_cover),
+            run_in_ingest_pool(audio_digest, path),
+        )
+
+    # Track-specific data
+    track = {
+        "temp_file": filename,
+        "title": metadata.get("title", Path(original_filename).stem),
+        "duration": metadata.get("duration", ""),
+        "track_number": metadata.get("track_number"),
+        "original_filename": original_filename,
+        "fingerprint": fingerprint,
+        "uploaded": None
+    }
+    return metadata, track
+
+
+async def mark_uploaded(tracks: list):
+    """
+    Segna le tracce già caricate in passato (stessa impronta audio) con il percorso remoto
+    """
+    known = await run_in_threadpool(fingerprints.lookup, [t["fingerprint"] for t in tracks])
+    for track in tracks:
+        track["uploaded"] = known.get(track["fingerprint"])
+
+
+async def store_upload_cover(cover: dict | None) -> str | None:
+    """
+    Salva la copertina estratta tra quelle degli upload e ritorna l'URL da cui servirla
+    """
+    if not cover:
+        return None
+    digest = await run_in_threadpool(cover_cache.put_upload, cover["data"], cover["mime"])
+    return f"/api/covers/{digest}"
+
+
+async def shared_album(metadata: dict) -> dict:
+    """
+    Metadati condivisi dell'album, presi dal primo file
+    """
+    return {
+        "album": metadata.get("album", ""),
+        "artist": metadata.get("artist", ""),
+        "genre": metadata.get("genre", ""),
+        "release_date": metadata.get("release_date", ""),
+        "cover": await store_upload_cover(metadata.get("cover"))
+    }
+
+
 @app.post("/api/upload-temp")
-async def upload_temp_batch(files: List[UploadFile] = File(...)):
+async def upload_temp_batch(request: Request, files: List[UploadFile] = File(...)):
     """
     Upload multiple MP3 files temporarily and extract metadata from each.
+    Files are processed concurrently; the response keeps the upload order.
     Returns shared metadata (from first file) and individual track info.
     """
+    # Tempo speso nel parsing multipart prima di arrivare qui
+    observe_stage("multipart", request.state.started)
+
     if not files:
         raise HTTPException(400, "Nessun file caricato")
 
@@ -195,68 +423,278 @@ async def upload_temp_batch(files: List[UploadFile] = File(...)):
 
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-    for i, file in enumerate(files):
-        
-        try:
-            # Check MIME type (solo MP3)
-            if file.content_type != "audio/mpeg":
-                errors.append(file.filename + ": tipologia di file non valida")
-                continue
+    # La copertina condivisa viene letta solo dal primo file
+    batch = uuid.uuid4().hex
+    results = await asyncio.gather(*(ingest_file(file, batch, i == 0) for i, file in enumerate(files)))
 
-            # Check estensione (solo .mp3)
-            ext = Path(file.filename).suffix.lower()
-            if ext != ".mp3":
-                errors.append(file.filename + ": estensione non valida")
-                continue
+    for i, (metadata, track, error) in enumerate(results):
 
-            filename = f"{uuid.uuid4()}_{Path(file.filename).name}"
-            temp_path = UPLOAD_DIR / filename
+        if error:
+            errors.append(error)
+            continue
 
-            contents = await file.read()
-            if len(contents) > MAX_SIZE:
-                errors.append(file.filename + ": file troppo grande")
-                continue
+        # Use first file's metadata as shared defaults
+        if i == 0:
+            shared_metadata = await shared_album(metadata)
+
+        tracks.append(track)
+
+    await mark_uploaded(tracks)
+
+    return {
+        "album": shared_metadata,
+        "tracks": tracks,
+        "errors": errors
+    }
+
+
+@app.post("/api/upload-temp/stream")
+async def upload_temp_stream(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Variante di upload-temp in streaming (NDJSON, un evento per riga):
+    {"type": "track", "index", "track"} appena i metadati di un file sono pronti,
+    {"type": "album", "album"} con i metadati condivisi del primo file,
+    {"type": "error", "index", "error"} per ogni file scartato e infine
+    {"type": "done", "tracks", "errors"}.
+    """
+    observe_stage("multipart", request.state.started)
+
+    if not files:
+        raise HTTPException(400, "Nessun file caricato")
+
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    # I file del form vengono chiusi quando l'handler ritorna: il salvataggio
+    # avviene qui, l'estrazione dei metadati durante lo streaming
+    batch = uuid.uuid4().hex
+
+    async def save(file):
+        async with ingest_limit:
+            return await save_file(file, batch)
 
+    saved = await asyncio.gather(*(save(file) for file in files))
+    originals = [file.filename for file in files]
+
+    async def extract(index, filename):
+        async with ingest_limit:
             try:
-                temp_path.write_bytes(contents)
+                metadata, track = await extract_track(filename, originals[index], index == 0)
+                await mark_uploaded([track])
+                return index, metadata, track, None
             except Exception as e:
-                errors.append(file.filename + ": errore durante il salvataggio - " + str(e))
-                continue
-                
-            if not temp_path.is_file():
-                errors.append(file.filename + ": file non salvato correttamente")
-                continue
+                return index, None, None, originals[index] + ": errore sconosciuto - " + str(e)
+
+    def event(data: dict) -> bytes:
+        return (json.dumps(data) + "\n").encode()
+
+    async def events():
+        errors = 0
+        for index, (filename, error) in enumerate(saved):
+            if error:
+                errors += 1
+                yield event({"type": "error", "index": index, "error": error})
+
+        tasks = [
+            asyncio.ensure_future(extract(index, filename))
+            for index, (filename, error) in enumerate(saved) if not error
+        ]
+        count = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, metadata, track, error = await next_done
+                if error:
+                    errors += 1
+                    yield event({"type": "error", "index": index, "error": error})
+                    continue
+                count += 1
+                yield event({"type": "track", "index": index, "track": track})
+                if index == 0:
+                    yield event({"type": "album", "album": await shared_album(metadata)})
+        finally:
+            # Client disconnesso: niente lavoro per nessuno
+            for task in tasks:
+                task.cancel()
+
+        yield event({"type": "done", "tracks": count, "errors": errors})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+async def finalize_tracks(states: list, errors: list, meta: dict, tracks_data: list, cover_data: bytes | None, album_only: bool = False):
+    """
+    Aggiorna i tag di ogni traccia di un album e la invia via SFTP,
+    aggiornando lo stato della traccia in states (stesso ordine di tracks_data).
+    album_only (bulk ingest): vengono scritti solo i campi dell'album, ogni
+    traccia conserva i propri artista e compositore (track["artist"]).
+    """
+    ready_files = []
+    by_file = {}
+    titles = {}
+
+    # Protetti dallo sweeper da upload_final_batch fino alla fine del job
+    temp_files = [t.get("temp_file") for t in tracks_data if t.get("temp_file")]
+
+    # Copertina normalizzata e APIC serializzato una volta per tutto l'album
+    cover = None
+    if cover_data:
+        try:
+            with timed("cover"):
+                cover = await run_in_threadpool(prepare_cover, cover_data)
+        except ValueError as e:
+            errors.append(f"Copertina ignorata: {e}")
+
+    # Numeri dal form o dai tag ("3/12", "A1"): non numerici = nessun prefisso
+    disc = parse_track_number(meta.get("disc"))
+
+    for track, state in zip(tracks_data, states):
+
+        title = track.get("title")
+
+        try:
 
-            metadata = extract_metadata(temp_path)
+            temp_file = track.get("temp_file")
+            duration = track.get("duration", "")
+            track_number = parse_track_number(track.get("track_number"))
+
+            if not temp_file or not title:
+                raise ValueError(f"Traccia con dati mancanti: {track}")
+
+            # Verify temp file exists and is valid
+            filepath = (UPLOAD_DIR / temp_file).resolve()
 
-            # Use first file's metadata as shared defaults
-            if i == 0:
-                shared_metadata = {
-                    "album": metadata.get("album", ""),
-                    "artist": metadata.get("artist", ""),
-                    "genre": metadata.get("genre", ""),
-                    "release_date": metadata.get("release_date", ""),
-                    "cover": metadata.get("cover", None)
+            if not str(filepath).startswith(str(UPLOAD_DIR.resolve())):
+                raise ValueError(f"Percorso file non valido: {temp_file}")
+
+            if not filepath.is_file():
+                raise ValueError(f"File non trovato: {temp_file}")
+
+            state["state"] = "tagging"
+
+            # Update metadata with shared + individual data
+            if album_only:
+                tags = {"artist": meta["artist"], "album": meta["album"], "disc": disc}
+            else:
+                tags = {
+                    "title": title,
+                    "artist": meta["artist"],
+                    "album": meta["album"],
+                    "genre": meta["genre"],
+                    "duration": duration,
+                    "release_date": meta["release_date"],
+                    "track_number": track_number
                 }
+            with timed("tag"):
+                await run_in_threadpool(update_metadata, filepath, tags, cover, album_only)
 
-            # Track-specific data
-            tracks.append({
-                "temp_file": filename,
-                "title": metadata.get("title", Path(file.filename).stem),
-                "duration": metadata.get("duration", ""),
-                "track_number": metadata.get("track_number"),
-                "original_filename": file.filename
+            # Upload to SFTP
+            state["state"] = "ready"
+            state["bytes_total"] = filepath.stat().st_size
+            ready_files.append({
+                "local_file": filepath,
+                "artist": meta["artist"],
+                "album": meta["album"],
+                "title": title,
+                "track_number": track_number,
+                "disc": disc,
             })
-            
+            by_file[filepath] = state
+            titles[filepath] = ((album_only and track.get("artist")) or meta["artist"], title)
+
+        except ValueError as e:
+            state["state"] = "error"
+            state["error"] = str(e)
+            errors.append(str(e))
         except Exception as e:
-            errors.append(file.filename + ": errore sconosciuto - " + str(e))
-            continue
+            state["state"] = "error"
+            state["error"] = str(e)
+            errors.append(f"Errore upload '{title}': {str(e)}")
 
-    return {
-        "album": shared_metadata,
-        "tracks": tracks,
-        "errors": errors
-    }
+    def progress(local_file, sent, total):
+        state = by_file[local_file]
+        state["state"] = "uploading"
+        state["bytes_sent"] = sent
+        state["bytes_total"] = total
+
+    def on_done(local_file, remote_path, error):
+        state = by_file[local_file]
+        state["state"] = "error" if error else "done"
+        state["error"] = error
+        state["remote_path"] = remote_path
+        # Caricato: impronta registrata, il file temporaneo non serve più
+        if not error:
+            record_upload(local_file, remote_path, meta, *titles[local_file])
+            temp_janitor.discard(local_file.name)
+
+    # Upload files to SFTP in threadpool
+    try:
+        await run_in_threadpool(upload_sftp, ready_files, errors, progress, on_done)
+    finally:
+        await temp_janitor.release(temp_files)
+
+
+def record_upload(local_file: Path, remote_path: str, meta: dict, artist: str, title: str):
+    # Nell'indice delle impronte; un errore qui non invalida l'upload
+    try:
+        fingerprints.record(
+            audio_digest(str(local_file)),
+            remote_path,
+            artist, meta["album"], title,
+            local_file.stat().st_size,
+        )
+    except Exception as e:
+        print(f"Errore registrando l'impronta di {local_file.name}: {e}")
+
+
+# Liste Navidrome che cambiano con qualsiasi nuovo album
+LIST_SCOPES = ["getArtists", "getIndexes", "getAlbumList2", "getGenres", "search3"]
+
+
+async def refresh_catalog(job: dict, artists: list):
+    """
+    Nuovi album visibili al prossimo caricamento della dashboard: scansione
+    Navidrome, poi aggiornamento di cache e catalogo per i soli artisti caricati.
+    L'esito della scansione è in job["scan"].
+    """
+    if not any(state["state"] == "done" for state in job["tracks"]):
+        return
+
+    if settings.NAVIDROME_RESCAN:
+        job["scan"] = {"state": "scanning", "count": None, "error": None}
+        try:
+            with timed("scan"):
+                status = await rescan_navidrome(settings.NAVIDROME_SCAN_TIMEOUT)
+            job["scan"]["count"] = status.get("count")
+
+            artist_ids = [await catalog.refresh_artist(artist) for artist in artists]
+            job["scan"]["state"] = "done"
+            if all(artist_ids):
+                await invalidate_navidrome_cache(LIST_SCOPES, artist_ids)
+                return
+        except Exception as e:
+            job["scan"]["state"] = "error"
+            job["scan"]["error"] = str(e)
+
+    # Senza scansione (o artista non ancora visibile) si aggiorna tutto alla prossima lettura
+    await invalidate_navidrome_cache()
+    await catalog.mark_stale()
+
+
+async def finalize_album(job: dict, meta: dict, tracks_data: list, cover_data: bytes | None, cover_id: str | None = None):
+    """
+    Job di upload-final: un album, stato per traccia nel job.
+    cover_id: copertina degli upload in uso dal job, rilasciata alla fine
+    """
+    try:
+        await finalize_tracks(job["tracks"], job["errors"], meta, tracks_data, cover_data)
+    finally:
+        if cover_id:
+            await run_in_threadpool(cover_cache.release_upload, cover_id)
+    await refresh_catalog(job, [meta["artist"]])
+
+    if job["errors"]:
+        job["message"] = f"Upload completato con {len(job['errors'])} errori"
+    else:
+        job["message"] = f"Album '{meta['album']}' caricato con successo! ({len(tracks_data)} tracce)"
 
 
 @app.post("/api/upload-final")
@@ -266,11 +704,14 @@ async def upload_final_batch(
     genre: str = Form(...),
     release_date: str = Form(...),
     tracks: str = Form(...),  # JSON: [{temp_file, title, duration}, ...]
-    cover: UploadFile = File(None)
+    cover: UploadFile = File(None),
+    cover_id: str = Form(None)  # hash di una copertina da /api/covers
 ):
     """
     Upload multiple tracks with shared album metadata.
     Each track keeps its own title and duration.
+    Tagging and SFTP transfer run as a background job: the response carries
+    the job id to poll on /api/jobs/{job_id}.
     """
     # Parse tracks JSON
     try:
@@ -287,70 +728,200 @@ async def upload_final_batch(
     except Exception:
         raise HTTPException(400, "Errore durante la lettura della copertina")
 
-    errors = []
-    ready_files = []
+    # Oppure la copertina estratta in upload-temp, protetta fino alla fine del job
+    if cover_data is None and cover_id:
+        cached = await run_in_threadpool(cover_cache.upload, cover_id) if COVER_DIGEST.fullmatch(cover_id) else None
+        if cached is None:
+            raise HTTPException(400, "Copertina non trovata")
+        cover_data = await run_in_threadpool(cached[0].read_bytes)
+    else:
+        cover_id = None
+
+    if cover_data and detect_image_mime(cover_data) is None:
+        raise HTTPException(400, "Formato copertina non supportato")
+
+    meta = {
+        "artist": artist,
+        "album": album,
+        "genre": genre,
+        "release_date": release_date,
+    }
 
-    for track in tracks_data:
-        
-        try:
-        
-            temp_file = track.get("temp_file")
-            title = track.get("title")
-            duration = track.get("duration", "")
-            track_number = track.get("track_number")
+    # I file restano su disco anche se il job attende in coda oltre TEMP_TTL
+    await temp_janitor.claim([t.get("temp_file") for t in tracks_data if t.get("temp_file")])
+    if cover_id:
+        await run_in_threadpool(cover_cache.claim_upload, cover_id)
 
-            if not temp_file or not title:
-                errors.append(f"Traccia con dati mancanti: {track}")
-                continue
+    job = await create_job(album, tracks_data)
+    await submit_job(job, finalize_album, meta, tracks_data, cover_data, cover_id)
 
-            # Verify temp file exists and is valid
-            filepath = (UPLOAD_DIR / temp_file).resolve()
+    return JSONResponse({
+        "message": f"Upload dell'album '{album}' avviato ({len(tracks_data)} tracce)",
+        "job_id": job["id"]
+    }, status_code=202)
 
-            if not str(filepath).startswith(str(UPLOAD_DIR.resolve())):
-                errors.append(f"Percorso file non valido: {temp_file}")
-                continue
 
-            if not filepath.is_file():
-                errors.append(f"File non trovato: {temp_file}")
-                continue
+# Stato upload-final
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Stato del job e di ogni traccia (stato, byte inviati, errori)"""
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job non trovato")
+    return job
 
-            # Update metadata with shared + individual data
-            await run_in_threadpool(
-                update_metadata,
-                filepath,
-                {
-                    "title": title,
-                    "artist": artist,
-                    "album": album,
-                    "genre": genre,
-                    "duration": duration,
-                    "release_date": release_date,
-                    "track_number": track_number
-                },
-                cover_data
+
+# ------------------------------
+# Bulk ingest (più album)
+# ------------------------------
+async def ingest_archive(file: UploadFile, batch: str):
+    """
+    Estrae gli MP3 di un archivio e ne legge i metadati.
+    Ritorna una lista di (metadata, track, errore) come ingest_file.
+    """
+    try:
+        with timed("save"):
+            saved = await run_in_threadpool(
+                extract_archive, file.file, file.filename, UPLOAD_DIR, MAX_SIZE, CHUNK_SIZE, settings.BULK_MAX_FILES
             )
+    except Exception as e:
+        return [(None, None, file.filename + ": errore durante l'estrazione - " + str(e))]
+
+    async def describe(original, filename, size, error):
+        if error:
+            return None, None, f"{file.filename}/{original}: {error}"
+        temp_janitor.register(batch, filename, size)
+        STAGE_BYTES.labels("in").inc(size)
+        async with ingest_limit:
+            try:
+                metadata, track = await extract_track(filename, original)
+            except Exception as e:
+                return None, None, f"{file.filename}/{original}: errore sconosciuto - {e}"
+        return metadata, track, None
 
-            # Upload to SFTP
-            ready_files.append((filepath, artist, title))
+    return await asyncio.gather(*(describe(*item) for item in saved))
+
+
+async def album_cover(tracks: list) -> bytes | None:
+    # Prima copertina incorporata tra le tracce del gruppo
+    for track in tracks:
+        metadata = await run_in_ingest_pool(extract_metadata, str(UPLOAD_DIR / track["temp_file"]), True)
+        if metadata.get("cover"):
+            return metadata["cover"]["data"]
+    return None
 
-        except Exception as e:
-            errors.append(f"Errore upload '{title}': {str(e)}")
-            
-    # Upload files to SFTP in threadpool
-    errors = upload_sftp(ready_files, errors)
 
-    # Cleanup old temp files
-    for f in UPLOAD_DIR.iterdir():
-        if f.is_file() and time.time() - f.stat().st_mtime > 600:
+async def finalize_bulk(job: dict, groups: list):
+    """
+    Job di bulk ingest: gli album vengono finalizzati in parallelo
+    (al massimo BULK_ALBUM_CONCURRENCY) e condividono il pool SFTP
+    """
+    limit = asyncio.Semaphore(settings.BULK_ALBUM_CONCURRENCY)
+    uploaded = set()
+    offsets = []
+    offset = 0
+    for group in groups:
+        offsets.append(offset)
+        offset += len(group["tracks"])
+
+    async def run(group, entry, start):
+        async with limit:
+            entry["status"] = "running"
+            meta = {key: group[key] for key in ("artist", "album", "disc", "genre", "release_date")}
             try:
-                f.unlink()
+                cover_data = await album_cover(group["tracks"])
             except Exception as e:
-                print(f"Errore cancellando {f}: {e}")
+                cover_data = None
+                entry["errors"].append(f"Copertina non letta: {e}")
+            states = job["tracks"][start:start + len(group["tracks"])]
+            try:
+                await finalize_tracks(states, entry["errors"], meta, group["tracks"], cover_data, album_only=True)
+                if any(s["state"] == "done" for s in states):
+                    uploaded.add(group["artist"])
+            finally:
+                entry["status"] = "failed" if any(s["state"] != "done" for s in states) else "done"
+                job["errors"].extend(f"{group['album']}: {e}" for e in entry["errors"])
+
+    await asyncio.gather(*(
+        run(group, entry, start) for group, entry, start in zip(groups, job["albums"], offsets)
+    ))
+    await refresh_catalog(job, sorted(uploaded))
+
+    failed = sum(1 for entry in job["albums"] if entry["status"] == "failed")
+    job["message"] = f"{len(groups) - failed} album su {len(groups)} caricati ({len(job['tracks'])} tracce)"
 
-    if errors:
-        return JSONResponse({
-            "message": f"Upload completato con {len(errors)} errori",
-            "errors": errors
-        }, status_code=207)
 
-    return JSONResponse({"message": f"Album '{album}' caricato con successo! ({len(tracks_data)} tracce)"})
\ No newline at end of file
+@app.post("/api/upload-bulk")
+async def upload_bulk(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Bulk ingest: MP3 e archivi zip/tar con più album.
+    Le tracce vengono raggruppate per artista dell'album, album e disco dai
+    tag esistenti e caricate con un unico job; lo stato per album e per
+    traccia è su /api/jobs/{job_id}.
+    """
+    observe_stage("multipart", request.state.started)
+
+    if not files:
+        raise HTTPException(400, "Nessun file caricato")
+
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    batch = uuid.uuid4().hex
+    results = await asyncio.gather(*(
+        ingest_archive(file, batch) if is_archive(file.filename or "") else ingest_file(file, batch)
+        for file in files
+    ))
+
+    items = []
+    errors = []
+    for result in results:
+        for metadata, track, error in (result if isinstance(result, list) else [result]):
+            if error:
+                errors.append(error)
+                continue
+            if not track["title"]:
+                track["title"] = Path(track["original_filename"]).stem
+            # Artista della traccia, distinto da quello dell'album (compilation)
+            track["artist"] = metadata.get("artist") or metadata.get("album_artist") or ""
+            items.append((metadata, track))
+
+    # Tracce già caricate in passato: non vengono ricaricate
+    await mark_uploaded([track for _, track in items])
+    skipped = [track for _, track in items if track["uploaded"]]
+    await temp_janitor.discard_many([track["temp_file"] for track in skipped])
+    items = [(metadata, track) for metadata, track in items if not track["uploaded"]]
+
+    if not items:
+        return JSONResponse({
+            "message": "Nessuna traccia da caricare",
+            "albums": [],
+            "skipped": skipped,
+            "errors": errors,
+        }, status_code=200 if skipped else 400)
+
+    groups = group_albums(items)
+    albums = [
+        {
+            "artist": group["artist"],
+            "album": group["album"],
+            "disc": group["disc"],
+            "tracks": len(group["tracks"]),
+            "status": "queued",
+            "errors": [],
+        }
+        for group in groups
+    ]
+
+    tracks_data = [track for group in groups for track in group["tracks"]]
+    await temp_janitor.claim([t["temp_file"] for t in tracks_data])
+
+    job = await create_job(f"{len(groups)} album", tracks_data, albums)
+    await submit_job(job, finalize_bulk, groups)
+
+    return JSONResponse({
+        "message": f"Upload di {len(groups)} album avviato ({len(tracks_data)} tracce)",
+        "job_id": job["id"],
+        "albums": albums,
+        "skipped": skipped,
+        "errors": errors,
+    }, status_code=202)
@@ -1,4 +1,4 @@
-import { showAlert, normalizeValue } from "./utils.js";
+import { showAlert } from "./utils.js";
 
 export async function apiRequest(url, params, raw_response=false) {
 
@@ -18,48 +18,48 @@ export async function apiRequest(url, params, raw_response=false) {
 
 }
 
-async function loadArtists() {
-    const artists = await apiRequest('/api/artists')
-    const artistList = document.getElementById("artists");
-    artistList.innerHTML = "";
-    artists.forEach(artist => {
-        const option = document.createElement("option");
-        option.value = artist.name;
-        option.dataset.id = artist.id
-        artistList.appendChild(option);
-    });
+// Suggerimenti dal server per il testo digitato (al posto delle liste complete)
+async function suggest(kind, query) {
+    return await apiRequest(`/api/suggest?kind=${kind}&q=${encodeURIComponent(query)}`) || [];
 }
 
-async function loadAlbums() {
-    const albums = await apiRequest('/api/albums')
-    const albumList = document.getElementById("albums");
-    albumList.innerHTML = "";
-    albums.forEach(album => {
-        const val = normalizeValue(album);
-        if (!val) return;
-        const option = document.createElement("option");
-        option.value = val;
-        albumList.appendChild(option);
-    });
-}
+async function loadSuggestions(kind, input, list) {
+    const query = input.value.trim();
+    if (!query) {
+        list.innerHTML = "";
+        return;
+    }
 
-async function loadGenres() {
-    const genres = await apiRequest('/api/genres')
-    const genreList = document.getElementById("genres");
-    genreList.innerHTML = "";
-    genres.forEach(genre => {
-        const val = normalizeValue(genre);
-        if (!val) return;
+    const results = await suggest(kind, query);
+
+    // Testo cambiato nel frattempo: risposta superata
+    if (input.value.trim() !== query) return;
+
+    list.innerHTML = "";
+    results.forEach(item => {
         const option = document.createElement("option");
-        option.value = val;
-        genreList.appendChild(option);
+        option.value = item.name;
+        if (item.id) option.dataset.id = item.id;
+        if (item.artist) option.label = item.artist;
+        list.appendChild(option);
     });
 }
 
 export async function loadOptions() {
-    await loadArtists();
-    await loadAlbums();
-    await loadGenres()
+    const fields = [
+        ["artist", "artist", "artists"],
+        ["album", "album", "albums"],
+        ["genre", "genre", "genres"],
+    ];
+    fields.forEach(([kind, inputId, listId]) => {
+        const input = document.getElementById(inputId);
+        const list = document.getElementById(listId);
+        let timeout;
+        input.addEventListener("input", () => {
+            clearTimeout(timeout);
+            timeout = setTimeout(() => loadSuggestions(kind, input, list), 150);
+        });
+    });
 }
 
 export async function checkDuplicates() {
@@ -67,26 +67,28 @@ export async function checkDuplicates() {
     const artist = document.getElementById("artist").value.trim();
     if (!artist) return;
 
-    const tracks = await apiRequest(
-        `/api/search-duplicates?artist=${encodeURIComponent(artist)}`
-    );
-
-    const trackIndex = new Set(
-        tracks.map(t => t.toLowerCase().trim())
-    );
+    const titleInputs = [...document.querySelectorAll(".title")];
 
-    const titleInputs = document.querySelectorAll(".title");
+    // Una sola richiesta per tutte le tracce dell'album
+    const result = await apiRequest("/api/check-duplicates", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+            artist: artist,
+            titles: titleInputs.map(input => input.value.trim())
+        })
+    });
 
-    titleInputs.forEach(input => {
+    if (!result) return;
 
-        const currentTitle = input.value.toLowerCase().trim();
+    titleInputs.forEach((input, index) => {
 
         // reset stato precedente
         input.classList.remove("is-duplicate");
         const existingMsg = input.closest(".track-item").querySelector(".duplicate-msg");
         if (existingMsg) existingMsg.remove();
 
-        if (trackIndex.has(currentTitle)) {
+        if (result.duplicates[index]) {
 
             input.classList.add("is-duplicate");
 
@@ -118,12 +120,18 @@ export async function loadArtistAlbums() {
     const input = document.getElementById("artist");
     const list = document.getElementById("artists");
 
-    const option = [...list.options]
-        .find(o => o.value === input.value);
+    let artistId = [...list.options]
+        .find(o => o.value === input.value)?.dataset.id;
+
+    // Artista impostato senza digitare (es. dai tag): id dai suggerimenti
+    if (!artistId && input.value.trim()) {
+        const match = (await suggest("artist", input.value.trim()))
+            .find(a => a.name.toLowerCase() === input.value.trim().toLowerCase());
+        artistId = match?.id;
+    }
 
-    if (option?.dataset.id) {
+    if (artistId) {
 
-        const artistId = option.dataset.id
         const albums = await apiRequest(`/api/albums/artist/${encodeURIComponent(artistId)}`)
 
         if (albums.length < 1 ) {
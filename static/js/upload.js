@@ -24,6 +24,66 @@ export function getBatchTracks() {
 
 // Batch upload functions for multi-file album upload
 
+// Riga di una traccia, inserita nella posizione del file nell'upload
+function renderTrack(track, index) {
+    const trackList = document.getElementById("trackList");
+    const trackBox = document.createElement("div");
+    trackBox.className = "card track-card m-2 p-2 rounded";
+    trackBox.dataset.position = index;
+    const trackItem = document.createElement("div");
+    trackItem.className = "track-item p-1 rounded";
+    const formattedDuration = formatDuration(track.duration);
+    // Use original track number from metadata, or fallback to index + 1
+    const trackNumber = track.track_number || (index + 1);
+    trackItem.innerHTML = `
+        <div class="d-flex align-items-center">
+            <input type="number"
+                class="form-control form-control-sm border-0 border-bottom track-number me-2"
+                style="width: 30px;"
+                value="${trackNumber}"
+                min="1">
+
+            <div class="position-relative w-100">
+                <input type="text"
+                    class="form-control form-control-sm border-0 border-bottom w-100 title track-title"
+                    data-index="${index}"
+                    data-tempfile="${track.temp_file}"
+                    value="${track.title || track.original_filename.replace(/\.[^/.]+$/, "")}"
+                    placeholder="Titolo traccia">
+
+                <span class="duplicate-badge">Duplicato</span>
+            </div>
+
+            ${track.uploaded ? `<span class="ms-2 small text-warning text-nowrap" title="${track.uploaded.remote_path}">Già caricato</span>` : ""}
+
+            <span class="ms-2 duration small">${formattedDuration}</span>
+        </div>
+    `;
+
+    trackBox.appendChild(trackItem);
+
+    const next = [...trackList.children].find(el => Number(el.dataset.position) > index);
+    trackList.insertBefore(trackBox, next || null);
+}
+
+function showDashboard() {
+    document.getElementById("uploadSection").style.display = "none";
+    document.getElementById("dashboardContent").style.display = "flex";
+    document.getElementById("trackListSection").style.display = "block";
+}
+
+// Metadati condivisi (dal primo file)
+function fillAlbum(shared) {
+    document.getElementById("artist").value = shared.artist || "";
+    document.getElementById("album").value = shared.album || "";
+    document.getElementById("genre").value = shared.genre || "";
+    document.getElementById("release_date").value = shared.release_date || "";
+
+    if (shared.cover) {
+        document.getElementById("coverImg").src = shared.cover;
+    }
+}
+
 export async function firstUpload(files) {
     
     if (!files || files.length === 0) {
@@ -40,81 +100,54 @@ export async function firstUpload(files) {
     spinner.style.display = "inline-block";
 
     try {
-        const data = await apiRequest("/api/upload-temp", {
+        // Una riga NDJSON per evento: le tracce compaiono appena pronte
+        const response = await apiRequest("/api/upload-temp/stream", {
             method: "POST",
             body: formData
-        });
+        }, true);
 
-        if (!data) {
+        if (!response) {
             showAlert("Nessuna risposta dal server", 'danger');
             return;
-        } 
-
-        spinner.style.display = "none";
-
-        if (data.errors && data.errors.length > 0) {
-            data.errors.forEach(err => showAlert("Errore: " + err, 'danger'));
-            return;
         }
 
         // Set batch mode
-        batchTracks = data.tracks;
-
-        // Show dashboard
-        document.getElementById("uploadSection").style.display = "none";
-        document.getElementById("dashboardContent").style.display = "flex";
-
-        // Populate shared metadata from first file
-        const shared = data.album;
-        document.getElementById("artist").value = shared.artist || "";
-        document.getElementById("album").value = shared.album || "";
-        document.getElementById("genre").value = shared.genre || "";
-        document.getElementById("release_date").value = shared.release_date || "";
-
-        if (shared.cover) {
-            document.getElementById("coverImg").src = shared.cover;
+        batchTracks = [];
+        document.getElementById("trackList").innerHTML = "";
+        let shown = false;
+
+        const handleEvent = (event) => {
+            if (event.type === "error") {
+                showAlert("Errore: " + event.error, 'danger');
+                return;
+            }
+            if (event.type === "done") {
+                if (event.tracks === 0) showAlert("Nessun file valido caricato", 'warning');
+                return;
+            }
+            if (!shown) {
+                showDashboard();
+                shown = true;
+            }
+            if (event.type === "track") {
+                batchTracks[event.index] = event.track;
+                renderTrack(event.track, event.index);
+            } else if (event.type === "album") {
+                fillAlbum(event.album);
+            }
+        };
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
         }
-
-        // Show and populate track list
-        const trackListSection = document.getElementById("trackListSection");
-        const trackList = document.getElementById("trackList");
-        trackListSection.style.display = "block";
-        trackList.innerHTML = "";
-
-        data.tracks.forEach((track, index) => {
-            const trackBox = document.createElement("div");
-            trackBox.className = "card track-card m-2 p-2 rounded";
-            const trackItem = document.createElement("div");
-            trackItem.className = "track-item p-1 rounded";
-            const formattedDuration = formatDuration(track.duration);
-            // Use original track number from metadata, or fallback to index + 1
-            const trackNumber = track.track_number || (index + 1);
-            trackItem.innerHTML = `
-                <div class="d-flex align-items-center">
-                    <input type="number"
-                        class="form-control form-control-sm border-0 border-bottom track-number me-2"
-                        style="width: 30px;"
-                        value="${trackNumber}"
-                        min="1">
-
-                    <div class="position-relative w-100">
-                        <input type="text"
-                            class="form-control form-control-sm border-0 border-bottom w-100 title track-title"
-                            data-index="${index}"
-                            data-tempfile="${track.temp_file}"
-                            value="${track.title || track.original_filename.replace(/\.[^/.]+$/, "")}"
-                            placeholder="Titolo traccia">
-
-                        <span class="duplicate-badge">Duplicato</span>
-                    </div>
-
-                    <span class="ms-2 duration small">${formattedDuration}</span>
-                </div>
-            `;
-
-            trackBox.appendChild(trackItem);
-            trackList.appendChild(trackBox);
-        });
+        if (buffer.trim()) handleEvent(JSON.parse(buffer));
 
     } catch (error) {
         console.error("Errore durante l'upload batch:", error);
@@ -124,6 +157,23 @@ export async function firstUpload(files) {
     }
 }
 
+// Polling dello stato di un job di upload-final
+async function waitForJob(jobId, saveBtn, interval = 1000) {
+    while (true) {
+        const job = await apiRequest(`/api/jobs/${encodeURIComponent(jobId)}`);
+        if (!job) throw new Error("Stato upload non disponibile");
+
+        const done = job.tracks.filter(t => t.state === "done" || t.state === "error").length;
+        saveBtn.textContent = job.scan?.state === "scanning"
+            ? "Scansione Navidrome..."
+            : `Caricamento ${done}/${job.tracks.length}...`;
+
+        if (job.status === "done" || job.status === "failed") return job;
+
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
 export async function finalUpload() {
 
     // Check if cover is set
@@ -176,18 +226,26 @@ export async function finalUpload() {
     // Add cover if changed
     if (coverFile) {
         formData.append("cover", coverFile);
+    } else if (coverImg.src.includes("/api/covers/")) {
+        // Copertina estratta dai file: il server la ha già
+        formData.append("cover_id", coverImg.src.split("/api/covers/")[1]);
     }
 
     document.getElementById("uploadSpinner").style.display = "inline-block";
 
     try {
-        const data = await apiRequest("/api/upload-final", {
+        const started = await apiRequest("/api/upload-final", {
             method: "POST",
             body: formData
         });
 
+        if (!started) return;
+
+        // Il server risponde subito con l'id del job: stato aggiornato via polling
+        const data = await waitForJob(started.job_id, saveBtn);
+
         if (data.errors && data.errors.length > 0) {
-            errors.forEach(err => showAlert("Errore: " + err, 'danger'));
+            data.errors.forEach(err => showAlert("Errore: " + err, 'danger'));
         } else {
             showAlert(data.message || "Album caricato con successo!", 'success');
         }
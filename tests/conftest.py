@@ -0,0 +1,15 @@
+import os
+import sys
+from pathlib import Path
+
+# Impostazioni minime per importare app.script.settings senza un .env
+DEFAULT_ENV = {
+    "SESSION_MAX_AGE": "3600",
+    "MAX_UPLOAD_SIZE_MB": "200",
+    "PORT": "8080",
+    "WORKERS": "1",
+}
+for key, value in DEFAULT_ENV.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
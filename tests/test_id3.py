@@ -0,0 +1,142 @@
+import struct
+
+import pytest
+
+from app.script import id3
+from app.script.metadata import extract_metadata, update_metadata
+from app.script.settings import settings
+
+# MPEG1 Layer III, 128 kbps, 44100 Hz, senza padding: frame da 417 byte
+FRAME_HEADER = b"\xff\xfb\x90\x00"
+FRAME_SIZE = 417
+
+
+def mpeg_frames(count: int) -> bytes:
+    return (FRAME_HEADER + b"\x00" * (FRAME_SIZE - 4)) * count
+
+
+def v23_tag(frames: dict) -> bytes:
+    body = b""
+    for fid, text in frames.items():
+        data = b"\x00" + text.encode("latin-1")
+        body += fid.encode("ascii") + struct.pack(">I", len(data)) + b"\x00\x00" + data
+    return b"ID3\x03\x00\x00" + id3._to_syncsafe(len(body)) + body
+
+
+def audio_of(path) -> bytes:
+    with open(path, "rb") as f:
+        start, end = id3.audio_bounds(f)
+        f.seek(start)
+        return f.read(end - start)
+
+
+def read(path) -> id3.Tag:
+    with open(path, "rb") as f:
+        return id3.read_tag(f)
+
+
+@pytest.fixture
+def mp3(tmp_path):
+    path = tmp_path / "track.mp3"
+    path.write_bytes(mpeg_frames(40))
+    return path
+
+# ------------------------
+# Scrittura: padding, in place, riscrittura
+# ------------------------
+def test_first_write_adds_padding(mp3):
+    audio = audio_of(mp3)
+    update_metadata(mp3, {"title": "Titolo", "artist": "Artista", "album": "Album"})
+
+    tag = read(mp3)
+    assert tag.version == 4
+    assert tag.text("TIT2") == "Titolo"
+    assert tag.text("TPE1") == "Artista"
+    assert tag.size >= settings.ID3_PADDING_KB * 1024
+    assert audio_of(mp3) == audio
+
+
+def test_update_within_padding_is_in_place(mp3):
+    update_metadata(mp3, {"title": "Primo", "artist": "Artista"})
+    size, tag_size = mp3.stat().st_size, read(mp3).size
+    audio = audio_of(mp3)
+
+    update_metadata(mp3, {"title": "Secondo titolo più lungo", "artist": "Artista", "genre": "Jazz"})
+
+    tag = read(mp3)
+    assert mp3.stat().st_size == size
+    assert tag.size == tag_size
+    assert tag.text("TIT2") == "Secondo titolo più lungo"
+    assert tag.text("TCON") == "Jazz"
+    assert audio_of(mp3) == audio
+
+
+def test_update_beyond_padding_rewrites(mp3):
+    update_metadata(mp3, {"title": "Titolo"})
+    tag_size = read(mp3).size
+    audio = audio_of(mp3)
+
+    cover = {"frame": id3.apic_frame("image/jpeg", b"\xff\xd8" + b"\x01" * tag_size)}
+    update_metadata(mp3, {"title": "Titolo"}, cover)
+
+    tag = read(mp3)
+    assert tag.size > tag_size
+    assert tag.picture() == ("image/jpeg", b"\xff\xd8" + b"\x01" * tag_size)
+    assert audio_of(mp3) == audio
+
+
+def test_unknown_frames_are_kept(mp3):
+    id3.write_tag(mp3, [id3.text_frame("TPUB", "Etichetta"), id3.text_frame("TIT2", "Vecchio")])
+    update_metadata(mp3, {"title": "Nuovo"})
+
+    tag = read(mp3)
+    assert tag.text("TPUB") == "Etichetta"
+    assert tag.text("TIT2") == "Nuovo"
+
+# ------------------------
+# Conversione da v2.3
+# ------------------------
+def test_v23_year_becomes_tdrc(tmp_path):
+    path = tmp_path / "v23.mp3"
+    path.write_bytes(v23_tag({"TIT2": "Titolo", "TYER": "1999", "TDAT": "3112"}) + mpeg_frames(40))
+
+    update_metadata(path, {"title": "Titolo", "artist": "Artista"})
+
+    tag = read(path)
+    assert tag.version == 4
+    assert tag.text("TDRC") == "1999-12-31"
+    assert not tag.get("TYER") and not tag.get("TDAT")
+
+
+def test_form_date_replaces_v23_year(tmp_path):
+    path = tmp_path / "v23.mp3"
+    path.write_bytes(v23_tag({"TYER": "1999"}) + mpeg_frames(40))
+
+    update_metadata(path, {"title": "Titolo", "release_date": "2001"})
+
+    assert read(path).get("TDRC") == [b"\x032001"]
+
+# ------------------------
+# Input insoliti: ID3Error (e fallback mutagen), mai eccezioni generiche
+# ------------------------
+def test_short_file_skips_id3v1_probe(tmp_path):
+    path = tmp_path / "short.mp3"
+    path.write_bytes(FRAME_HEADER + b"\x00" * 40)
+    with open(path, "rb") as f:
+        assert id3.audio_length(f, 0) >= 0
+
+
+def test_truncated_xing_raises_id3error(tmp_path):
+    path = tmp_path / "xing.mp3"
+    # Xing subito dopo header e side info (4 + 32 byte), troncato dopo i flag
+    path.write_bytes(FRAME_HEADER + b"\x00" * 32 + b"Xing\x00\x00")
+    with open(path, "rb") as f, pytest.raises(id3.ID3Error):
+        id3.audio_length(f, 0)
+
+
+def test_empty_apic_is_ignored(mp3):
+    id3.write_tag(mp3, [id3.frame("APIC", b""), id3.text_frame("TIT2", "Titolo")])
+
+    metadata = extract_metadata(str(mp3), include_cover=True)
+    assert metadata["title"] == "Titolo"
+    assert metadata["cover"] is None